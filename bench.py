@@ -0,0 +1,552 @@
+"""
+性能基准测试
+
+用法: python bench.py [sync] [search] [plan] [download] [listing] [readme] [writes] [stream]
+"""
+import io
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import chardet
+from sqlalchemy import Boolean, Column, Integer, String, create_engine, select, text, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from consts import GAME_NAME_MAP
+from db import (
+    Base,
+    DBWriter,
+    FlingTrainerAppModel,
+    check_listing_plan,
+    create_db_engine,
+    explain_listing,
+    init_search_index,
+    save_readmes,
+    search_apps,
+    sync_apps,
+    upgrade_schema,
+)
+from decoder import ReadmeDecoder
+from downloader import FileDownloader
+from extractor import ZipStreamExtractor
+from http_client import HttpClient
+
+
+def make_app_list(n, changed=0):
+    """
+    生成n条模拟数据, 其中前changed条的链接和热门标记发生变化
+    """
+    app_list = {}
+    for i in range(n):
+        app_list[f"Game {i:06d}"] = {
+            "page_url": f"https://flingtrainer.com/trainer/game-{i}{'-v2' if i < changed else ''}/",
+            "hot": i < changed,
+            "new": i % 50 == 0,
+        }
+    return app_list
+
+
+def make_session(tmp_dir, name):
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, name)}")
+    Base.metadata.create_all(engine)
+    upgrade_schema(engine)
+    return engine, sessionmaker(bind=engine)
+
+
+def legacy_sync(session, app_list):
+    # 旧版逐行查询逐行提交
+    for name_en, app_data in app_list.items():
+        app = session.query(FlingTrainerAppModel).filter_by(name_en=name_en).first()
+        if app:
+            app.page_url = app_data.get("page_url")
+            app.is_hot = app_data.get("hot", False)
+            app.is_new = app_data.get("new", False)
+        else:
+            session.add(
+                FlingTrainerAppModel(
+                    name_en=name_en,
+                    name_zh=name_en,
+                    page_url=app_data.get("page_url"),
+                    is_hot=app_data.get("hot", False),
+                    is_new=app_data.get("new", False),
+                )
+            )
+        session.commit()
+
+
+def bench_sync(sizes=(1000, 10000, 50000), legacy_max=10000):
+    print(f"{'rows':>8} {'mode':>8} {'insert(s)':>10} {'resync(s)':>10}  result")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in sizes:
+            first = make_app_list(n)
+            second = make_app_list(n, changed=n // 10)
+
+            engine, Session = make_session(tmp_dir, f"bulk_{n}.db")
+            session = Session()
+            t1 = time.perf_counter()
+            sync_apps(session, first)
+            session.commit()
+            t2 = time.perf_counter()
+            result = sync_apps(session, second)
+            session.commit()
+            t3 = time.perf_counter()
+            session.close()
+            engine.dispose()
+            result.pop("changes")
+            print(f"{n:>8} {'bulk':>8} {t2-t1:>10.3f} {t3-t2:>10.3f}  {result}")
+
+            if n > legacy_max:
+                continue
+            engine, Session = make_session(tmp_dir, f"legacy_{n}.db")
+            session = Session()
+            t1 = time.perf_counter()
+            legacy_sync(session, first)
+            t2 = time.perf_counter()
+            legacy_sync(session, second)
+            t3 = time.perf_counter()
+            session.close()
+            engine.dispose()
+            print(f"{n:>8} {'legacy':>8} {t2-t1:>10.3f} {t3-t2:>10.3f}")
+
+
+def make_readme(i, repeat=1):
+    return (
+        f"Notes for build {i}: disable anti-cheat before launching. 使用前请关闭杀毒软件。\n"
+        * repeat
+    )
+
+
+def make_rows(n):
+    names = list(GAME_NAME_MAP.items())
+    rows = []
+    for i in range(n):
+        name_en, name_zh = names[i % len(names)]
+        rows.append(
+            {
+                "name_en": f"{name_en} {i:06d}",
+                "name_zh": f"{name_zh}{i}",
+                "page_url": f"https://flingtrainer.com/trainer/game-{i}/",
+                "is_hot": i % 97 == 0,
+                "is_new": i % 89 == 0,
+                "download": i % 500 == 0,
+            }
+        )
+    return rows
+
+
+def fill_apps(session, n, readme_repeat=1):
+    """
+    直接写入n条带中文名和说明文本的模拟数据
+    """
+    session.execute(FlingTrainerAppModel.__table__.insert(), make_rows(n))
+    ids = session.scalars(select(FlingTrainerAppModel.id).order_by(FlingTrainerAppModel.id))
+    save_readmes(session, {id: make_readme(i, readme_repeat) for i, id in enumerate(ids)})
+    session.commit()
+
+
+def bench_search(sizes=(10000, 100000), repeat=20):
+    queries = ["Creed", "刺客信条", "Age of Empires", "002345", "Storm"]
+    print(f"{'rows':>8} {'query':>16} {'like(ms)':>10} {'fts(ms)':>10} {'like/fts rows':>14}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in sizes:
+            engine, Session = make_session(tmp_dir, f"search_{n}.db")
+            if not init_search_index(engine):
+                print("当前SQLite不支持FTS5 trigram")
+                return
+            session = Session()
+            fill_apps(session, n)
+            for q in queries:
+                timings = {}
+                counts = {}
+                for fts in (False, True):
+                    t1 = time.perf_counter()
+                    for _ in range(repeat):
+                        counts[fts] = len(search_apps(session, q, fts=fts).all())
+                    timings[fts] = (time.perf_counter() - t1) / repeat * 1000
+                print(
+                    f"{n:>8} {q:>16} {timings[False]:>10.2f} {timings[True]:>10.2f} "
+                    f"{counts[False]:>6}/{counts[True]:<6}"
+                )
+            session.close()
+            engine.dispose()
+
+
+def check_plan(n=10000):
+    """
+    列表查询退化为全表扫描或临时排序时以非零状态退出
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine, Session = make_session(tmp_dir, "plan.db")
+        session = Session()
+        sync_apps(session, make_app_list(n))
+        session.commit()
+        session.execute(text("ANALYZE"))
+        for args in (("", False), ("", True), ("abc", False)):
+            print(args, explain_listing(session, *args))
+        problems = check_listing_plan(session)
+        session.close()
+        engine.dispose()
+    if problems:
+        print("列表查询计划退化:", problems)
+        sys.exit(1)
+    print("OK")
+
+
+class UnseekableWriter(io.RawIOBase):
+    """
+    不能seek的输出, zipfile写入时会使用数据描述符, 与边压缩边上传的打包工具相同
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+def check_stream_extract(feed_sizes=(4096, 7777, 65536, 1024 * 1024)):
+    """
+    按不同的分块大小把zip交给边下载边解压的解压器, 结果与原文件不一致时以非零状态退出;
+    包含使用数据描述符、解压后超过输出分块大小的deflate成员
+    """
+    rnd = random.Random(1)
+    files = {
+        f"data/part{i}.txt": b"".join(
+            f"line {rnd.randint(0, 50)} value {j % 97}\n".encode()
+            for j in range(40000 + i * 20000)
+        )
+        for i in range(4)
+    }
+    files["readme.txt"] = "使用前请关闭杀毒软件".encode("utf-8")
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        archives = {}
+        seekable = os.path.join(tmp_dir, "seekable.zip")
+        with zipfile.ZipFile(seekable, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, data in files.items():
+                archive.writestr(name, data)
+        archives["seekable"] = seekable
+        writer = UnseekableWriter()
+        with zipfile.ZipFile(writer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, data in files.items():
+                archive.writestr(name, data)
+        archives["descriptor"] = os.path.join(tmp_dir, "descriptor.zip")
+        with open(archives["descriptor"], "wb") as f:
+            f.write(writer.data)
+        for kind, path in archives.items():
+            with open(path, "rb") as f:
+                data = f.read()
+            for step in feed_sizes:
+                dest = os.path.join(tmp_dir, f"{kind}_{step}")
+                extractor = ZipStreamExtractor(dest)
+                for i in range(0, len(data), step):
+                    extractor.feed(data[i : i + step])
+                ok = extractor.finish(path)
+                if ok:
+                    for name, content in files.items():
+                        with open(os.path.join(dest, name), "rb") as f:
+                            ok = ok and f.read() == content
+                print(f"{kind:>10} {step:>8} {'OK' if ok else extractor.failed}")
+                if not ok:
+                    problems.append((kind, step, extractor.failed))
+    if problems:
+        print("边下载边解压失败:", problems)
+        sys.exit(1)
+
+
+LegacyBase = declarative_base()
+
+
+class LegacyAppModel(LegacyBase):
+    """
+    说明文本还在列表表中时的表结构
+    """
+
+    __tablename__ = "legacy_app"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name_zh = Column(String)
+    name_en = Column(String, unique=True)
+    page_url = Column(String)
+    download = Column(Boolean, default=False)
+    is_hot = Column(Boolean, default=False)
+    is_new = Column(Boolean, default=False)
+    save_path = Column(String)
+    readme = Column(String)
+    app_md5 = Column(String)
+    update_date = Column(String)
+    is_removed = Column(Boolean, default=False)
+
+
+def measure(func):
+    """
+    Returns:
+        tuple: (结果占用的内存MB, 峰值内存MB, 耗时秒)
+    """
+    tracemalloc.start()
+    t1 = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - t1
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current / 1048576, peak / 1048576, elapsed
+
+
+def bench_listing(sizes=(10000, 50000), readme_repeat=20):
+    """
+    列表查询的内存占用: 旧版读取整行(含说明文本) vs 只取列表需要的列
+    """
+    print(f"{'rows':>8} {'mode':>8} {'held(MB)':>9} {'peak(MB)':>9} {'time(s)':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in sizes:
+            engine, Session = make_session(tmp_dir, f"listing_{n}.db")
+            LegacyBase.metadata.create_all(engine)
+            session = Session()
+            fill_apps(session, n, readme_repeat)
+            session.execute(
+                LegacyAppModel.__table__.insert(),
+                [
+                    {**row, "readme": make_readme(i, readme_repeat)}
+                    for i, row in enumerate(make_rows(n))
+                ],
+            )
+            session.commit()
+
+            def legacy():
+                data = session.query(LegacyAppModel).all()
+                return [(row.id, bool(row.readme)) for row in data], data
+
+            def projected():
+                data = search_apps(session).all()
+                return [(row.id, bool(row.has_readme)) for row in data], data
+
+            for mode, func in (("legacy", legacy), ("columns", projected)):
+                held, peak, elapsed = measure(func)
+                session.expunge_all()
+                print(f"{n:>8} {mode:>8} {held:>9.1f} {peak:>9.1f} {elapsed:>8.3f}")
+            session.close()
+            engine.dispose()
+
+
+README_SAMPLES = {
+    "ascii": ("utf-8", "Num 1 - Infinite Health\nNum 2 - Infinite Ammo\nCtrl+Num 1 - Edit Gold\n"),
+    "utf-8": ("utf-8", "数字键1 - 无限生命\n数字键2 - 无限弹药\nCtrl+数字键1 - 修改金钱\n"),
+    "utf-8-bom": ("utf-8-sig", "数字键1 - 无限生命\n数字键2 - 无限弹药\n"),
+    "utf-16": ("utf-16", "数字键1 - 无限生命\nNum 2 - Infinite Ammo\n"),
+    "gbk": ("gbk", "数字键1 - 无限生命\n数字键2 - 无限弹药\n使用前请关闭杀毒软件。\n"),
+    "big5": ("big5", "數字鍵1 - 無限生命\n數字鍵2 - 無限彈藥\n使用前請關閉防毒軟體。\n"),
+    "shift-jis": ("shift_jis", "テンキー1 - 体力無限\nテンキー2 - 弾薬無限\n"),
+    "cp1252": ("cp1252", "Café Münster – naïve résumé, “quoted”\n"),
+}
+
+
+def make_readme_corpus(sizes=(2 * 1024, 16 * 1024, 128 * 1024)):
+    """
+    各种编码的模拟说明文本, 开头都是一段英文说明
+    """
+    header = "FLiNG Trainer\nPlease read the notes below before use.\n\n"
+    corpus = []
+    for name, (encoding, body) in README_SAMPLES.items():
+        for size in sizes:
+            text = header + body * max(1, size // len(body.encode(encoding)))
+            corpus.append((name, size, text, text.encode(encoding)))
+    return corpus
+
+
+def bench_readme(repeat=5):
+    corpus = make_readme_corpus()
+    print(f"{'encoding':>10} {'size':>6} {'chardet(ms)':>11} {'cold(ms)':>9} {'warm(ms)':>9}  result")
+    for name, size, text, data in corpus:
+        t1 = time.perf_counter()
+        for _ in range(repeat):
+            encoding = chardet.detect(data)["encoding"] or "utf-8"
+            legacy = data.decode(encoding, errors="ignore")
+        t2 = time.perf_counter()
+        for _ in range(repeat):
+            decoded, _ = ReadmeDecoder().decode(data)
+        t3 = time.perf_counter()
+        decoder = ReadmeDecoder()
+        decoder.decode(data)
+        t4 = time.perf_counter()
+        for _ in range(repeat):
+            decoded, encoding = decoder.decode(data)
+        t5 = time.perf_counter()
+        result = f"{encoding} {'ok' if decoded == text else 'MISMATCH'}"
+        if legacy != text:
+            result += " (chardet mismatch)"
+        print(
+            f"{name:>10} {size // 1024:>5}K {(t2-t1)/repeat*1000:>11.2f} "
+            f"{(t3-t2)/repeat*1000:>9.2f} {(t5-t4)/repeat*1000:>9.2f}  {result}"
+        )
+
+
+def bench_writes(n=20000, threads=4, writes=200):
+    """
+    多个线程同时写入时, 比较默认配置各自提交和WAL加写线程合并提交, 同时测量读取延迟
+    """
+    print(f"{n}行, {threads}个写线程各{writes}次写入, 同时一个线程反复搜索")
+    print(
+        f"{'mode':>8} {'write(s)':>9} {'commits':>8} {'locked':>7} "
+        f"{'reads':>6} {'read p50(ms)':>12} {'read max(ms)':>12}"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in ("default", "wal"):
+            url = f"sqlite:///{os.path.join(tmp_dir, f'writes_{mode}.db')}"
+            if mode == "wal":
+                engine = create_db_engine(url, pool_size=threads + 2)
+            else:
+                engine = create_engine(url)
+            Base.metadata.create_all(engine)
+            init_search_index(engine)
+            Session = sessionmaker(bind=engine)
+            session = Session()
+            fill_apps(session, n)
+            ids = list(session.scalars(select(FlingTrainerAppModel.id)))
+            session.close()
+            writer = DBWriter(Session) if mode == "wal" else None
+            locked = []
+            latencies = []
+            stop = threading.Event()
+
+            def write(session, id):
+                session.execute(
+                    update(FlingTrainerAppModel)
+                    .where(FlingTrainerAppModel.id == id)
+                    .values(app_md5=f"{id}-{time.perf_counter()}")
+                )
+
+            def writes_thread(k):
+                for i in range(writes):
+                    id = ids[(k * writes + i) * 7 % len(ids)]
+                    if writer:
+                        writer.run(write, id)
+                        continue
+                    session = Session()
+                    try:
+                        write(session, id)
+                        session.commit()
+                    except OperationalError:
+                        locked.append(id)
+                        session.rollback()
+                    finally:
+                        session.close()
+
+            def reads_thread():
+                session = Session()
+                while not stop.is_set():
+                    t1 = time.perf_counter()
+                    search_apps(session, "Creed").all()
+                    session.rollback()
+                    latencies.append((time.perf_counter() - t1) * 1000)
+                session.close()
+
+            reader = threading.Thread(target=reads_thread)
+            reader.start()
+            t1 = time.perf_counter()
+            workers = [threading.Thread(target=writes_thread, args=(k,)) for k in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - t1
+            stop.set()
+            reader.join()
+            commits = threads * writes - len(locked)
+            if writer:
+                commits = writer.stats["commits"]
+                writer.close()
+            latencies.sort()
+            print(
+                f"{mode:>8} {elapsed:>9.2f} {commits:>8} {len(locked):>7} {len(latencies):>6} "
+                f"{latencies[len(latencies) // 2]:>12.2f} {latencies[-1]:>12.2f}"
+            )
+            engine.dispose()
+
+
+def serve_throttled(data, rate):
+    """
+    启动支持Range的本地HTTP服务, 每个连接限速rate字节/秒
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_headers(self, code, start, end):
+            self.send_response(code)
+            self.send_header("ETag", '"bench"')
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(end - start + 1))
+            if code == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            self.end_headers()
+
+        def do_HEAD(self):
+            self.send_headers(200, 0, len(data) - 1)
+
+        def do_GET(self):
+            start, end, code = 0, len(data) - 1, 200
+            match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            if match:
+                start, code = int(match.group(1)), 206
+                end = int(match.group(2)) if match.group(2) else end
+            self.send_headers(code, start, end)
+            step = 64 * 1024
+            for offset in range(start, end + 1, step):
+                self.wfile.write(data[offset : min(offset + step, end + 1)])
+                time.sleep(step / rate)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/trainer.zip"
+
+
+def bench_download(size=12 * 1024 * 1024, rate=2 * 1024 * 1024, segments=(1, 2, 4, 8)):
+    data = os.urandom(size)
+    server, url = serve_throttled(data, rate)
+    http = HttpClient(pool_size=max(segments))
+    print(f"{size // 1048576}MB, 每连接限速{rate / 1048576:.1f}MB/s")
+    print(f"{'segments':>8} {'time(s)':>8} {'MB/s':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in segments:
+            path = os.path.join(tmp_dir, f"trainer_{n}.zip")
+            downloader = FileDownloader(http, segments=n, segment_threshold=0)
+            result = downloader.download(url, path)
+            assert result["size"] == size
+            speed = size / result["elapsed"] / 1048576
+            print(f"{result['segments']:>8} {result['elapsed']:>8.2f} {speed:>8.2f}")
+    http.close()
+    server.shutdown()
+
+
+BENCHMARKS = {
+    "sync": bench_sync,
+    "search": bench_search,
+    "plan": check_plan,
+    "download": bench_download,
+    "listing": bench_listing,
+    "readme": bench_readme,
+    "writes": bench_writes,
+    "stream": check_stream_extract,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
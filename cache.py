@@ -0,0 +1,445 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import requests
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+
+from db import (
+    SYNC_BATCH_SIZE,
+    ArchiveBlobModel,
+    ArchiveSourceModel,
+    FlingTrainerAppInfoModel,
+)
+
+
+class PageCache:
+    """
+    页面缓存, 保存上次响应内容和ETag/Last-Modified, 用于发送条件请求
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._pending = {}
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return (
+            os.path.join(self.cache_dir, f"{key}.json"),
+            os.path.join(self.cache_dir, f"{key}.html"),
+        )
+
+    def load(self, url):
+        """
+        读取缓存的元数据, 缓存不存在或已损坏时返回None
+        """
+        meta_path, body_path = self._paths(url)
+        if not (os.path.exists(meta_path) and os.path.exists(body_path)):
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def read_body(self, url):
+        _, body_path = self._paths(url)
+        with open(body_path, "rb") as f:
+            return f.read()
+
+    def fetch(self, url, headers=None, http=requests):
+        """
+        发送条件请求获取页面
+
+        Returns:
+            dict: {"status", "text", "changed"}, 304或内容哈希未变化时changed为False
+        """
+        headers = dict(headers or {})
+        meta = self.load(url)
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        response = http.get(url, headers=headers)
+        if response.status_code == 304 and meta:
+            body = self.read_body(url)
+            return {
+                "status": 304,
+                "text": body.decode(meta.get("encoding") or "utf-8", errors="replace"),
+                "changed": False,
+            }
+        response.raise_for_status()
+        body = response.content
+        digest = hashlib.sha256(body).hexdigest()
+        new_meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "encoding": response.encoding,
+            "sha256": digest,
+        }
+        changed = not meta or meta.get("sha256") != digest
+        self._pending[url] = (new_meta, body if changed else None)
+        if not changed:
+            # 内容未变化, 只刷新校验信息
+            self.commit(url)
+        return {"status": response.status_code, "text": response.text, "changed": changed}
+
+    def commit(self, url):
+        """
+        在内容处理成功后写入缓存, 避免处理失败后下次被误判为未变化
+        """
+        pending = self._pending.pop(url, None)
+        if pending is None:
+            return
+        meta, body = pending
+        meta_path, body_path = self._paths(url)
+        if body is not None:
+            self._write(body_path, body)
+        self._write(meta_path, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+    def invalidate(self, url):
+        self._pending.pop(url, None)
+        for path in self._paths(url):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def _write(path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+class AppInfoCache:
+    """
+    详情页解析结果的SQLite缓存, 以page_url为键, 带有效期和按访问时间的LRU淘汰
+    """
+
+    def __init__(self, Session, ttl, max_entries, writer):
+        """
+        Args:
+            Session (): 数据库会话工厂, 只用于读取
+            writer (DBWriter): 写队列, 与其他写操作共用同一个
+        """
+        self.Session = Session
+        self.writer = writer
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, page_url):
+        """
+        读取未过期的缓存并刷新访问时间, 不存在或已过期时返回None
+        """
+        session = self.Session()
+        try:
+            info = session.get(FlingTrainerAppInfoModel, page_url)
+            now = time.time()
+            if info is None or now - (info.fetched_at or 0) > self.ttl:
+                self._count(False)
+                return None
+            self._count(True)
+            app_info = {
+                "title": info.title,
+                "md5": info.md5,
+                "url": info.url,
+                "date": info.date,
+                "file_type": info.file_type,
+            }
+        finally:
+            session.close()
+        # 访问时间只影响淘汰顺序, 不等待写入
+        self.writer.submit(self._touch, page_url, now)
+        return app_info
+
+    @staticmethod
+    def _touch(session, page_url, now):
+        session.execute(
+            update(FlingTrainerAppInfoModel)
+            .where(FlingTrainerAppInfoModel.page_url == page_url)
+            .values(accessed_at=now)
+        )
+
+    def put(self, page_url, app_info):
+        self.put_many({page_url: app_info})
+
+    def put_many(self, app_infos):
+        """
+        批量写入解析结果, 写入后按访问时间淘汰超出容量的条目
+        """
+        if not app_infos:
+            return
+        model = FlingTrainerAppInfoModel
+        now = time.time()
+        rows = [
+            {
+                "page_url": page_url,
+                "title": app_info.get("title"),
+                "url": app_info.get("url"),
+                "date": app_info.get("date"),
+                "file_type": app_info.get("file_type"),
+                "md5": app_info.get("md5"),
+                "fetched_at": now,
+                "accessed_at": now,
+            }
+            for page_url, app_info in app_infos.items()
+        ]
+        self.writer.run(self._put_rows, rows)
+
+    def _put_rows(self, session, rows):
+        model = FlingTrainerAppInfoModel
+        stmt = insert(model.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[model.page_url],
+            set_={k: stmt.excluded[k] for k in rows[0] if k != "page_url"},
+        )
+        session.execute(stmt, rows)
+        overflow = session.scalar(select(func.count()).select_from(model)) - (
+            self.max_entries
+        )
+        if overflow > 0:
+            oldest = (
+                select(model.page_url)
+                .order_by(model.accessed_at)
+                .limit(overflow)
+                .scalar_subquery()
+            )
+            session.execute(delete(model).where(model.page_url.in_(oldest)))
+
+    def missing(self, page_urls, margin=0):
+        """
+        返回没有缓存或已过期的page_url, 不影响命中统计和访问时间
+
+        Args:
+            margin (float): 剩余有效期不足该秒数的也视为过期
+        """
+        model = FlingTrainerAppInfoModel
+        page_urls = list(page_urls)
+        fresh = set()
+        session = self.Session()
+        try:
+            for i in range(0, len(page_urls), SYNC_BATCH_SIZE):
+                fresh.update(
+                    session.scalars(
+                        select(model.page_url).where(
+                            model.page_url.in_(page_urls[i : i + SYNC_BATCH_SIZE]),
+                            model.fetched_at >= time.time() - self.ttl + margin,
+                        )
+                    )
+                )
+        finally:
+            session.close()
+        return [page_url for page_url in page_urls if page_url not in fresh]
+
+    def invalidate(self, page_url=None):
+        """
+        删除指定page_url的缓存, page_url为None时清空全部
+        """
+        self.writer.run(self._invalidate, page_url)
+
+    @staticmethod
+    def _invalidate(session, page_url):
+        model = FlingTrainerAppInfoModel
+        stmt = delete(model)
+        if page_url is not None:
+            stmt = stmt.where(model.page_url == page_url)
+        session.execute(stmt)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+class ArchiveStore:
+    """
+    按内容SHA-256保存下载的压缩包, 记录下载地址和校验值, 超出容量时按最近使用淘汰
+    """
+
+    def __init__(self, Session, store_dir, max_bytes, writer):
+        self.Session = Session
+        self.writer = writer
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 正在使用(解压)的压缩包不会被淘汰
+        self._in_use = {}
+
+    def path(self, sha256):
+        return os.path.join(self.store_dir, sha256[:2], sha256)
+
+    def has(self, sha256):
+        return bool(sha256) and os.path.exists(self.path(sha256))
+
+    def source(self, url):
+        """
+        返回url上次下载时记录的 {"sha256", "etag", "last_modified", "size"}
+        """
+        session = self.Session()
+        try:
+            row = session.get(ArchiveSourceModel, url)
+            if row is None:
+                return None
+            return {
+                "sha256": row.sha256,
+                "etag": row.etag,
+                "last_modified": row.last_modified,
+                "size": row.size,
+            }
+        finally:
+            session.close()
+
+    @staticmethod
+    def same_version(source, size, etag, last_modified):
+        """
+        比较服务器当前返回的校验值和记录的是否一致, 没有可比较的校验值时返回None
+        """
+        if size and source.get("size") and size != source["size"]:
+            return False
+        if etag and source.get("etag"):
+            return etag == source["etag"]
+        if last_modified and source.get("last_modified"):
+            return last_modified == source["last_modified"]
+        return None
+
+    def lookup(self, url, size, etag, last_modified):
+        """
+        url的内容与记录一致且压缩包仍在存储中时返回其哈希;
+        返回的压缩包已经hold, 不会被淘汰, 使用完后调用release
+        """
+        source = self.source(url)
+        if source is None or not self.same_version(source, size, etag, last_modified):
+            return None
+        sha256 = source["sha256"]
+        # 与evict使用同一把锁, 检查存在和hold之间不会被删除
+        with self._lock:
+            if not self.has(sha256):
+                return None
+            self._in_use[sha256] = self._in_use.get(sha256, 0) + 1
+        self.touch(sha256)
+        return sha256
+
+    def touch(self, sha256):
+        self.writer.submit(self._touch, sha256, time.time())
+
+    @staticmethod
+    def _touch(session, sha256, last_used):
+        session.execute(
+            update(ArchiveBlobModel)
+            .where(ArchiveBlobModel.sha256 == sha256)
+            .values(last_used=last_used)
+        )
+
+    def add(self, file_path, sha256, url, etag=None, last_modified=None):
+        """
+        把下载好的文件移入存储并记录来源, 内容已存在时直接丢弃新文件;
+        加入的压缩包已经hold, 使用完后调用release
+
+        Returns:
+            str: 存储中的路径
+        """
+        target = self.path(sha256)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        size = os.path.getsize(file_path)
+        blob = {"sha256": sha256, "size": size, "last_used": time.time()}
+        source = {
+            "url": url,
+            "sha256": sha256,
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": size,
+        }
+        # 先hold, 相同内容已在存储中时也不会在这期间被其他任务淘汰
+        self.hold(sha256)
+        try:
+            if os.path.exists(target):
+                os.remove(file_path)
+            else:
+                # 下载目录可能与存储不在同一磁盘, 先移动到临时文件再重命名, 中断时不会留下不完整的压缩包
+                tmp_path = f"{target}.tmp"
+                shutil.move(file_path, tmp_path)
+                os.replace(tmp_path, target)
+            self.writer.run(self._add_rows, blob, source)
+        except Exception:
+            self.release(sha256)
+            raise
+        self.evict()
+        return target
+
+    @staticmethod
+    def _add_rows(session, blob, source):
+        for model, values, key in (
+            (ArchiveBlobModel, blob, "sha256"),
+            (ArchiveSourceModel, source, "url"),
+        ):
+            stmt = insert(model.__table__).values(values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[key],
+                set_={k: stmt.excluded[k] for k in values if k != key},
+            )
+            session.execute(stmt)
+
+    def hold(self, sha256):
+        with self._lock:
+            self._in_use[sha256] = self._in_use.get(sha256, 0) + 1
+
+    def release(self, sha256):
+        with self._lock:
+            self._in_use[sha256] -= 1
+            if not self._in_use[sha256]:
+                del self._in_use[sha256]
+
+    def evict(self):
+        """
+        总大小超过上限时从最久未使用的压缩包开始删除, 正在使用的不删除
+        """
+        session = self.Session()
+        try:
+            total = session.scalar(select(func.coalesce(func.sum(ArchiveBlobModel.size), 0)))
+            if total <= self.max_bytes:
+                return
+            blobs = session.execute(
+                select(ArchiveBlobModel.sha256, ArchiveBlobModel.size).order_by(
+                    ArchiveBlobModel.last_used
+                )
+            ).all()
+        finally:
+            session.close()
+        evicted = []
+        for sha256, size in blobs:
+            if total <= self.max_bytes:
+                break
+            with self._lock:
+                if sha256 in self._in_use:
+                    continue
+                path = self.path(sha256)
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size or 0
+            evicted.append(sha256)
+        if evicted:
+            self.writer.run(self._delete_rows, evicted)
+
+    @staticmethod
+    def _delete_rows(session, evicted):
+        session.execute(delete(ArchiveBlobModel).where(ArchiveBlobModel.sha256.in_(evicted)))
+        session.execute(
+            delete(ArchiveSourceModel).where(ArchiveSourceModel.sha256.in_(evicted))
+        )
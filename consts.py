@@ -1,3 +1,54 @@
+TRAINER_LIST_URL = "https://flingtrainer.com/all-trainers-a-z/"
+# HTTP(连接超时, 读取超时)秒
+HTTP_TIMEOUT = (10, 60)
+# 幂等请求的重试次数
+HTTP_RETRIES = 3
+# 每个主机的最大连接数
+HTTP_POOL_SIZE = 8
+# 搜索框输入停顿多久后开始搜索(毫秒)
+SEARCH_DEBOUNCE_MS = 200
+# 同时进行的下载任务数
+DOWNLOAD_CONCURRENCY = 2
+# 同一主机同时进行的下载任务数
+DOWNLOAD_PER_HOST = 2
+# 分段下载的连接数, 1为不分段
+DOWNLOAD_SEGMENTS = 4
+# 文件超过该大小才分段下载(字节)
+DOWNLOAD_SEGMENT_THRESHOLD = 8 * 1024 * 1024
+# 预取的详情页信息有效期(秒)
+APP_INFO_MAX_AGE = 60 * 60
+# 详情页缓存的最大条目数
+APP_INFO_CACHE_SIZE = 2000
+# 默认预取并发数
+PREFETCH_WORKERS = 4
+# 后台预取详情页的间隔(分钟), 应小于APP_INFO_MAX_AGE, 0为只在刷新列表后预取
+PREFETCH_MINUTES = 20
+# 压缩包缓存的默认上限(MB)
+ARCHIVE_CACHE_MB = 2048
+# 后台刷新列表的间隔(分钟), 0为不刷新
+CATALOG_REFRESH_MINUTES = 6 * 60
+# 后台检查已下载应用更新的间隔(分钟), 0为不检查
+UPDATE_CHECK_MINUTES = 12 * 60
+# 后台任务失败后第一次重试的等待时间(秒), 之后每次失败加倍
+SCHEDULER_RETRY = 5 * 60
+# 检查后台任务是否到期的间隔(毫秒)
+SCHEDULER_TICK_MS = 30 * 1000
+# 数据库连接池大小, 界面, 搜索, 下载和检查更新线程各自占用连接
+DB_POOL_SIZE = 8
+# 每个数据库连接的页缓存(MB)
+DB_CACHE_MB = 16
+# 数据库文件内存映射的大小(MB)
+DB_MMAP_MB = 256
+# 数据库被锁时的最长等待时间(毫秒)
+DB_BUSY_TIMEOUT_MS = 5000
+# 写线程一次提交合并的最多写操作数
+DB_WRITE_BATCH = 100
+# 选择性解压的规则, 按文件名匹配, 没有匹配到修改器时全部解压
+EXTRACT_RULES = {
+    "trainer": ["*trainer.exe"],
+    "include": ["readme*.txt", "*.dll", "*.ini", "*.cfg", "*.config", "*.json", "*.xml"],
+}
+
 GAME_NAME_MAP = {
     "Ace Combat 7: Skies Unknown": "皇牌空战7：未知天空",
     "Against the Storm": "对抗风暴",
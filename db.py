@@ -1,8 +1,49 @@
-from sqlalchemy import Boolean, Column, Integer, String
+import queue
+import re
+import threading
+import zlib
+from concurrent.futures import Future
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Float,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    bindparam,
+    create_engine,
+    delete,
+    event,
+    inspect,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base
 
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # 未安装pypinyin时不支持拼音搜索
+    lazy_pinyin = None
+
 Base = declarative_base()
 
+# 每批写入的行数
+SYNC_BATCH_SIZE = 500
+# 全文索引表, trigram分词要求搜索词至少3个字符
+FTS_TABLE = "flingtrainer_app_fts"
+FTS_COLUMNS = ("name_zh", "name_en", "name_pinyin", "name_initials")
+# bm25列权重, 名称高于拼音
+FTS_WEIGHTS = (10.0, 10.0, 5.0, 5.0)
+FTS_MIN_LENGTH = 3
+# 说明文本压缩存储, 单独建不保存原文的全文索引, 相关度权重低于名称和拼音
+README_FTS_TABLE = "flingtrainer_readme_fts"
+README_FTS_WEIGHT = 1.0
+
 
 class FlingTrainerAppModel(Base):
     __tablename__ = "flingtrainer_app"
@@ -14,6 +55,751 @@ class FlingTrainerAppModel(Base):
     is_hot = Column(Boolean, default=False)
     is_new = Column(Boolean, default=False)
     save_path = Column(String)
-    readme = Column(String)
+    # 说明文本在flingtrainer_readme中, 列表只需要知道有没有
+    has_readme = Column(Boolean, default=False)
     app_md5 = Column(String)
     update_date = Column(String)
+    is_removed = Column(Boolean, default=False)
+    # 规范化后的名称, 用于列表排序
+    sort_key = Column(String)
+    # 中文名的全拼和首字母, 用于拼音搜索
+    name_pinyin = Column(String, index=True)
+    name_initials = Column(String, index=True)
+    # 已安装压缩包的内容哈希
+    content_sha256 = Column(String)
+
+    # 与列表查询的ORDER BY一致, 并包含列表取出和过滤用到的全部列(LISTING_COLUMNS),
+    # 排序和LIKE/拼音前缀过滤都只读索引(COVERING INDEX), 不回表
+    __table_args__ = (
+        Index(
+            "ix_flingtrainer_app_listing",
+            download.desc(),
+            is_hot.desc(),
+            is_new.desc(),
+            sort_key,
+            name_en,
+            name_zh,
+            page_url,
+            is_removed,
+            has_readme,
+            name_pinyin,
+            name_initials,
+        ),
+    )
+
+
+# 列表需要的列, 列表查询只取这些列
+LISTING_COLUMNS = (
+    FlingTrainerAppModel.id,
+    FlingTrainerAppModel.name_zh,
+    FlingTrainerAppModel.name_en,
+    FlingTrainerAppModel.page_url,
+    FlingTrainerAppModel.download,
+    FlingTrainerAppModel.has_readme,
+    FlingTrainerAppModel.is_hot,
+    FlingTrainerAppModel.is_new,
+    FlingTrainerAppModel.is_removed,
+)
+
+
+class FlingTrainerReadmeModel(Base):
+    """
+    应用的说明文本, zlib压缩保存, 查看时才读取
+    """
+
+    __tablename__ = "flingtrainer_readme"
+    app_id = Column(Integer, primary_key=True)
+    content = Column(LargeBinary)
+
+
+class ReadmeEncodingModel(Base):
+    """
+    需要检测编码的说明文本按内容哈希记录检测结果
+    """
+
+    __tablename__ = "readme_encoding"
+    sha256 = Column(String, primary_key=True)
+    encoding = Column(String)
+
+
+class FlingTrainerAppInfoModel(Base):
+    """
+    详情页解析结果缓存, 由后台预取和下载/更新写入
+    """
+
+    __tablename__ = "flingtrainer_app_info"
+    page_url = Column(String, primary_key=True)
+    title = Column(String)
+    url = Column(String)
+    date = Column(String)
+    file_type = Column(String)
+    md5 = Column(String)
+    fetched_at = Column(Float)
+    accessed_at = Column(Float, index=True)
+
+
+class ArchiveBlobModel(Base):
+    """
+    内容寻址存储中的压缩包
+    """
+
+    __tablename__ = "archive_blob"
+    sha256 = Column(String, primary_key=True)
+    size = Column(Integer)
+    last_used = Column(Float, index=True)
+
+
+class ArchiveSourceModel(Base):
+    """
+    下载地址到内容哈希的映射, 以及下载时服务器返回的校验值
+    """
+
+    __tablename__ = "archive_source"
+    url = Column(String, primary_key=True)
+    sha256 = Column(String, index=True)
+    etag = Column(String)
+    last_modified = Column(String)
+    size = Column(Integer)
+
+
+class DownloadJobModel(Base):
+    """
+    下载队列中的任务, 重启后继续
+    """
+
+    __tablename__ = "download_job"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    app_id = Column(Integer, index=True)
+    # download / update
+    kind = Column(String)
+    # 数字越小越优先
+    priority = Column(Integer, default=0)
+    # queued / running / paused / done / failed / cancelled
+    status = Column(String, default="queued", index=True)
+    host = Column(String)
+    created_at = Column(Float)
+    error = Column(String)
+
+
+def create_db_engine(url, pool_size=8, cache_mb=16, mmap_mb=256, busy_timeout_ms=5000):
+    """
+    创建开启WAL的SQLite引擎, 读操作不会被写操作阻塞; 每个新连接设置缓存和同步等参数
+
+    Args:
+        url (str): 数据库地址
+        pool_size (int): 连接池大小, 超出时最多再临时打开同样多的连接
+        cache_mb (int): 每个连接的页缓存(MB)
+        mmap_mb (int): 内存映射的大小(MB)
+        busy_timeout_ms (int): 数据库被锁时的最长等待时间(毫秒)
+    """
+    engine = create_engine(
+        url,
+        pool_size=pool_size,
+        max_overflow=pool_size,
+        connect_args={"check_same_thread": False, "timeout": busy_timeout_ms / 1000},
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # WAL模式下NORMAL只在断电时可能丢失最后的提交, 不会损坏数据库
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size={-cache_mb * 1024}")
+        cursor.execute(f"PRAGMA mmap_size={mmap_mb * 1024 * 1024}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    return engine
+
+
+class DBWriter:
+    """
+    所有写操作在同一个线程中按提交顺序执行, 积压的写操作合并为一次提交;
+    合并提交失败时回滚并逐个重新执行, 出错的写操作不影响其他写操作.
+    写操作是func(session, ...), 只修改数据不提交, 可能被重新执行, 不应有数据库以外的副作用;
+    返回值在会话关闭后使用, 不要返回ORM对象
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self, Session, batch_size=BATCH_SIZE):
+        """
+        Args:
+            Session (): 数据库会话工厂
+            batch_size (int): 一次提交合并的最多写操作数
+        """
+        self.Session = Session
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {"writes": 0, "commits": 0, "failures": 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        加入写队列, 不等待执行
+
+        Returns:
+            Future: 结果为func的返回值
+        """
+        future = Future()
+        self.start()
+        self._queue.put((func, args, kwargs, future))
+        return future
+
+    def run(self, func, *args, **kwargs):
+        """
+        加入写队列并等待提交完成, 返回func的返回值
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("写操作中不能等待其他写操作")
+        return self.submit(func, *args, **kwargs).result()
+
+    def flush(self):
+        """
+        等待之前加入的写操作全部提交
+        """
+        self.run(lambda session: None)
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            batch = [job for job in batch if job[3].set_running_or_notify_cancel()]
+            if batch and not self._commit(batch):
+                if len(batch) == 1:
+                    self.stats["failures"] += 1
+                else:
+                    for job in batch:
+                        if not self._commit([job]):
+                            self.stats["failures"] += 1
+            if stop:
+                return
+
+    def _commit(self, batch):
+        session = self.Session()
+        try:
+            results = [func(session, *args, **kwargs) for func, args, kwargs, _ in batch]
+            session.commit()
+        except Exception as err:
+            session.rollback()
+            if len(batch) == 1:
+                print(f"写入数据库失败: {err}")
+                batch[0][3].set_exception(err)
+            return False
+        finally:
+            session.close()
+        self.stats["writes"] += len(batch)
+        self.stats["commits"] += 1
+        for (_, _, _, future), result in zip(batch, results):
+            future.set_result(result)
+        return True
+
+
+def upgrade_schema(engine):
+    """
+    为已存在的表补充模型中新增的列和索引, 列与模型不一致的索引重建
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    ddl += f" DEFAULT {int(column.default.arg) if isinstance(column.default.arg, bool) else repr(column.default.arg)}"
+                conn.execute(text(ddl))
+            existing_indexes = {
+                i["name"]: i["column_names"] for i in inspector.get_indexes(table.name)
+            }
+            for index in table.indexes:
+                columns = existing_indexes.get(index.name)
+                if columns is not None and columns != [c.name for c in index.columns]:
+                    index.drop(conn)
+                    columns = None
+                if columns is None:
+                    index.create(conn)
+
+
+def make_sort_key(name_zh, name_en):
+    """
+    生成排序键: 优先中文名, 合并空白并忽略大小写
+    """
+    return " ".join((name_zh or name_en or "").split()).casefold()
+
+
+def make_pinyin(name_zh):
+    """
+    生成中文名的全拼和首字母, 不含中文或未安装pypinyin时返回空字符串
+
+    Returns:
+        tuple: (全拼, 首字母), 例如 皇牌空战 -> ("huangpaikongzhan", "hpkz")
+    """
+    if not name_zh or not re.search(r"[\u4e00-\u9fff]", name_zh):
+        return "", ""
+    if lazy_pinyin is None:
+        return None, None
+
+    def join(parts):
+        return "".join(c for c in "".join(parts).casefold() if c.isalnum())
+
+    return join(lazy_pinyin(name_zh)), join(lazy_pinyin(name_zh, style=Style.FIRST_LETTER))
+
+
+def derived_columns(name_zh, name_en):
+    """
+    由名称计算出的派生列, 新增和改名时写入
+    """
+    name_pinyin, name_initials = make_pinyin(name_zh)
+    return {
+        "sort_key": make_sort_key(name_zh, name_en),
+        "name_pinyin": name_pinyin,
+        "name_initials": name_initials,
+    }
+
+
+def backfill_derived_columns(engine):
+    """
+    为旧数据补全排序键和拼音列
+    """
+    model = FlingTrainerAppModel
+    with engine.begin() as conn:
+        conditions = model.sort_key.is_(None)
+        if lazy_pinyin is not None:
+            conditions = conditions | model.name_pinyin.is_(None)
+        rows = conn.execute(
+            select(model.id, model.name_zh, model.name_en).where(conditions)
+        ).all()
+        if rows:
+            conn.execute(
+                update(model.__table__)
+                .where(model.__table__.c.id == bindparam("row_id"))
+                .values(
+                    sort_key=bindparam("sort_key"),
+                    name_pinyin=bindparam("name_pinyin"),
+                    name_initials=bindparam("name_initials"),
+                ),
+                [
+                    {"row_id": row.id, **derived_columns(row.name_zh, row.name_en)}
+                    for row in rows
+                ],
+            )
+        # 布尔列为空时排序无法完全走索引
+        for column in ("download", "is_hot", "is_new", "is_removed"):
+            conn.execute(
+                text(f"UPDATE flingtrainer_app SET {column} = 0 WHERE {column} IS NULL")
+            )
+    return len(rows)
+
+
+def explain_listing(session, search_text="", downloaded=False):
+    """
+    返回列表查询的EXPLAIN QUERY PLAN明细
+    """
+    query = search_apps(session, search_text, downloaded, fts=False)
+    compiled = query.statement.compile(
+        dialect=session.bind.dialect, compile_kwargs={"literal_binds": True}
+    )
+    return [
+        row[-1]
+        for row in session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+    ]
+
+
+def check_listing_plan(session):
+    """
+    检查列表查询是否只读列表索引(COVERING INDEX)并按索引排序,
+    出现其他访问方式或临时排序时返回问题列表
+    """
+    problems = []
+    for args in (("", False), ("", True), ("abc", False)):
+        for detail in explain_listing(session, *args):
+            if detail.startswith(("SCAN", "SEARCH")) and (
+                "USING COVERING INDEX ix_flingtrainer_app_listing" not in detail
+            ):
+                problems.append((args, detail))
+            if "TEMP B-TREE" in detail:
+                problems.append((args, detail))
+    return problems
+
+
+def compress_readme(readme):
+    return zlib.compress(readme.encode("utf-8"))
+
+
+def decompress_readme(content):
+    return zlib.decompress(content).decode("utf-8") if content else ""
+
+
+def has_table(conn, name):
+    return (
+        conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": name}
+        ).first()
+        is not None
+    )
+
+
+def migrate_readmes(engine):
+    """
+    把旧版flingtrainer_app.readme列中的说明文本压缩后移到flingtrainer_readme, 然后删除该列
+
+    Returns:
+        int: 迁移的条数
+    """
+    columns = {c["name"] for c in inspect(engine).get_columns("flingtrainer_app")}
+    if "readme" not in columns:
+        return 0
+    with engine.begin() as conn:
+        rows = conn.execute(
+            text(
+                "SELECT id, readme FROM flingtrainer_app "
+                "WHERE readme IS NOT NULL AND readme != ''"
+            )
+        ).all()
+        if rows:
+            conn.execute(
+                insert(FlingTrainerReadmeModel.__table__).on_conflict_do_nothing(),
+                [{"app_id": id, "content": compress_readme(readme)} for id, readme in rows],
+            )
+            conn.execute(
+                update(FlingTrainerAppModel.__table__)
+                .where(FlingTrainerAppModel.__table__.c.id == bindparam("row_id"))
+                .values(has_readme=True),
+                [{"row_id": id} for id, _ in rows],
+            )
+        # 旧的全文索引触发器引用了readme列, 由init_search_index重建
+        for suffix in ("ai", "ad", "au"):
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}"))
+        try:
+            conn.execute(text("ALTER TABLE flingtrainer_app DROP COLUMN readme"))
+        except OperationalError:
+            # SQLite 3.35以前不支持删除列, 清空以释放空间
+            conn.execute(text("UPDATE flingtrainer_app SET readme = NULL"))
+    return len(rows)
+
+
+def load_readme(session, app_id):
+    content = session.scalar(
+        select(FlingTrainerReadmeModel.content).where(
+            FlingTrainerReadmeModel.app_id == app_id
+        )
+    )
+    return decompress_readme(content)
+
+
+def save_readmes(session, readmes):
+    """
+    批量保存说明文本并更新has_readme和全文索引, 文本为空时删除; 不提交事务
+
+    Args:
+        readmes (dict): {app_id: 说明文本}
+    """
+    model = FlingTrainerReadmeModel
+    ids = list(readmes)
+    fts = has_table(session, README_FTS_TABLE)
+    for i in range(0, len(ids), SYNC_BATCH_SIZE):
+        batch = ids[i : i + SYNC_BATCH_SIZE]
+        if fts:
+            # 不保存原文的全文索引删除时需要提供原来的文本
+            old = session.execute(
+                select(model.app_id, model.content).where(model.app_id.in_(batch))
+            ).all()
+            if old:
+                session.execute(
+                    text(
+                        f"INSERT INTO {README_FTS_TABLE}({README_FTS_TABLE}, rowid, readme) "
+                        "VALUES ('delete', :id, :readme)"
+                    ),
+                    [{"id": id, "readme": decompress_readme(c)} for id, c in old],
+                )
+        session.execute(delete(model).where(model.app_id.in_(batch)))
+        rows = [
+            {"app_id": id, "content": compress_readme(readmes[id])}
+            for id in batch
+            if readmes[id]
+        ]
+        if rows:
+            session.execute(insert(model.__table__), rows)
+            if fts:
+                session.execute(
+                    text(
+                        f"INSERT INTO {README_FTS_TABLE}(rowid, readme) VALUES (:id, :readme)"
+                    ),
+                    [{"id": id, "readme": readmes[id]} for id in batch if readmes[id]],
+                )
+        for flag in (True, False):
+            flagged = [id for id in batch if bool(readmes[id]) == flag]
+            if flagged:
+                session.execute(
+                    update(FlingTrainerAppModel)
+                    .where(FlingTrainerAppModel.id.in_(flagged))
+                    .values(has_readme=flag)
+                )
+
+
+def save_readme(session, app_id, readme):
+    save_readmes(session, {app_id: readme or ""})
+
+
+def init_search_index(engine):
+    """
+    创建FTS5全文索引及同步触发器, 当前SQLite不支持FTS5 trigram时返回False;
+    说明文本的索引不保存原文, 由save_readmes维护
+    """
+    columns = ", ".join(FTS_COLUMNS)
+    new_values = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+    old_values = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+    ddl = [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            {columns},
+            content='flingtrainer_app', content_rowid='id', tokenize='trigram'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON flingtrainer_app BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON flingtrainer_app BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns})
+            VALUES ('delete', old.id, {old_values});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+        AFTER UPDATE OF {columns} ON flingtrainer_app BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns})
+            VALUES ('delete', old.id, {old_values});
+            INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values});
+        END""",
+    ]
+    try:
+        with engine.begin() as conn:
+            existing = [
+                row[1] for row in conn.execute(text(f"PRAGMA table_info({FTS_TABLE})"))
+            ]
+            created = existing != list(FTS_COLUMNS)
+            if existing and created:
+                # 索引列有变化, 重建全文索引和触发器
+                for suffix in ("ai", "ad", "au"):
+                    conn.execute(text(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}"))
+                conn.execute(text(f"DROP TABLE {FTS_TABLE}"))
+            for sql in ddl:
+                conn.execute(text(sql))
+            if created:
+                # 为已有数据建立索引
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+            if not has_table(conn, README_FTS_TABLE):
+                conn.execute(
+                    text(
+                        f"""CREATE VIRTUAL TABLE {README_FTS_TABLE} USING fts5(
+                            readme, content='', tokenize='trigram'
+                        )"""
+                    )
+                )
+                rows = conn.execute(
+                    select(FlingTrainerReadmeModel.app_id, FlingTrainerReadmeModel.content)
+                ).all()
+                if rows:
+                    conn.execute(
+                        text(
+                            f"INSERT INTO {README_FTS_TABLE}(rowid, readme) VALUES (:id, :readme)"
+                        ),
+                        [{"id": id, "readme": decompress_readme(c)} for id, c in rows],
+                    )
+    except OperationalError as err:
+        print(f"全文索引不可用: {err}")
+        return False
+    return True
+
+
+def search_apps(session, search_text="", downloaded=False, fts=True):
+    """
+    构建列表查询, 只取列表需要的列; 搜索词足够长时走名称和说明文本的全文索引并按相关度排序,
+    否则退回LIKE
+
+    Returns:
+        Query: 未执行的查询
+    """
+    model = FlingTrainerAppModel
+    query = session.query(*LISTING_COLUMNS)
+    order = [model.download.desc()]
+    if search_text:
+        if fts and len(search_text) >= FTS_MIN_LENGTH:
+            ranked = (
+                text(
+                    f"SELECT id, SUM(rank) AS rank FROM ("
+                    f"SELECT rowid AS id, bm25({FTS_TABLE}, {', '.join(map(str, FTS_WEIGHTS))}) AS rank "
+                    f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match "
+                    f"UNION ALL "
+                    f"SELECT rowid AS id, bm25({README_FTS_TABLE}) * {README_FTS_WEIGHT} AS rank "
+                    f"FROM {README_FTS_TABLE} WHERE {README_FTS_TABLE} MATCH :match"
+                    f") GROUP BY id"
+                )
+                .bindparams(match='"' + search_text.replace('"', '""') + '"')
+                .columns(id=Integer, rank=Float)
+                .subquery()
+            )
+            query = query.join(ranked, ranked.c.id == model.id)
+            order.append(ranked.c.rank)
+        else:
+            # 拼音和首字母按前缀走索引
+            prefix = search_text.casefold()
+            query = query.filter(
+                model.name_zh.like(f"%{search_text}%")
+                | model.name_en.like(f"%{search_text}%")
+                | ((model.name_initials >= prefix) & (model.name_initials < prefix + "\uffff"))
+                | ((model.name_pinyin >= prefix) & (model.name_pinyin < prefix + "\uffff"))
+            )
+    if downloaded:
+        query = query.filter(model.download == True)
+    order += [model.is_hot.desc(), model.is_new.desc(), model.sort_key, model.name_en]
+    return query.order_by(*order)
+
+
+def sync_apps(session, app_list, name_map=None):
+    """
+    对比数据库中的现有目录, 只写入新增和变化的行, 由调用方提交, 全部在一个事务内完成;
+    网站上已经消失的条目标记为is_removed而不是删除
+
+    Args:
+        session (): 数据库会话
+        app_list (dict): getlist()返回的 {name_en: {"page_url", "hot", "new"}}
+        name_map (dict): 英文名到中文名的映射, 仅在新增时使用
+
+    Returns:
+        dict: 各类数量以及changes变更集, changes中为受影响行的id列表
+    """
+    name_map = name_map or {}
+    model = FlingTrainerAppModel
+    existing = {
+        row.name_en: row
+        for row in session.execute(
+            select(
+                model.id,
+                model.name_en,
+                model.page_url,
+                model.is_hot,
+                model.is_new,
+                model.is_removed,
+            )
+        )
+    }
+    changes = {
+        "added": [],
+        "removed": [],
+        "restored": [],
+        "url_changed": [],
+        "hot_changed": [],
+        "new_changed": [],
+    }
+    added_names = []
+    unchanged = 0
+    rows = []
+    for name_en, app_data in app_list.items():
+        page_url = app_data.get("page_url")
+        is_hot = bool(app_data.get("hot", False))
+        is_new = bool(app_data.get("new", False))
+        old = existing.get(name_en)
+        if old is None:
+            added_names.append(name_en)
+        else:
+            changed = False
+            if old.page_url != page_url:
+                changes["url_changed"].append(old.id)
+                changed = True
+            if bool(old.is_hot) != is_hot:
+                changes["hot_changed"].append(old.id)
+                changed = True
+            if bool(old.is_new) != is_new:
+                changes["new_changed"].append(old.id)
+                changed = True
+            if old.is_removed:
+                changes["restored"].append(old.id)
+                changed = True
+            if not changed:
+                unchanged += 1
+                continue
+        rows.append(
+            {
+                "name_en": name_en,
+                "name_zh": name_map.get(name_en, name_en),
+                # 已有行冲突时不更新名称, 只有新增行需要计算派生列
+                **(
+                    derived_columns(name_map.get(name_en, name_en), name_en)
+                    if old is None
+                    else dict.fromkeys(("sort_key", "name_pinyin", "name_initials"))
+                ),
+                "page_url": page_url,
+                "is_hot": is_hot,
+                "is_new": is_new,
+                "is_removed": False,
+                "download": False,
+            }
+        )
+    # 列表为空多半是页面结构变化导致解析失败, 此时不做下架标记
+    if app_list:
+        changes["removed"] = [
+            row.id
+            for name_en, row in existing.items()
+            if name_en not in app_list and not row.is_removed
+        ]
+
+    stmt = insert(model.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[model.name_en],
+        set_={
+            "page_url": stmt.excluded.page_url,
+            "is_hot": stmt.excluded.is_hot,
+            "is_new": stmt.excluded.is_new,
+            "is_removed": stmt.excluded.is_removed,
+        },
+    )
+    for i in range(0, len(rows), SYNC_BATCH_SIZE):
+        session.execute(stmt, rows[i : i + SYNC_BATCH_SIZE])
+    removed = changes["removed"]
+    for i in range(0, len(removed), SYNC_BATCH_SIZE):
+        session.execute(
+            update(model)
+            .where(model.id.in_(removed[i : i + SYNC_BATCH_SIZE]))
+            .values(is_removed=True)
+        )
+    for i in range(0, len(added_names), SYNC_BATCH_SIZE):
+        changes["added"].extend(
+            session.scalars(
+                select(model.id).where(model.name_en.in_(added_names[i : i + SYNC_BATCH_SIZE]))
+            )
+        )
+    return {
+        "inserted": len(added_names),
+        "updated": len(rows) - len(added_names),
+        "unchanged": unchanged,
+        "removed": len(changes["removed"]),
+        "changes": changes,
+    }
@@ -0,0 +1,137 @@
+import codecs
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import chardet
+
+from db import ReadmeEncodingModel
+
+# 按顺序检查的BOM, UTF-32要在UTF-16之前
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+NON_ASCII = re.compile(r"[^\x00-\x7f]")
+CJK = re.compile(r"[　-〿一-鿿＀-￯]")
+
+
+class ReadmeDecoder:
+    """
+    说明文本解码: 先检查BOM并尝试严格的UTF-8/GB2312解码, 都不行时只对开头一段做编码检测;
+    需要检测的结果按内容哈希缓存, 同一份说明文本不再重复检测
+    """
+
+    SAMPLE_SIZE = 16 * 1024
+    CACHE_SIZE = 512
+    # 解码结果中非ASCII字符至少有这个比例是中文字符才采用, 避免把其他编码误判为GB2312
+    GBK_MIN_CJK_RATIO = 0.9
+
+    def __init__(
+        self, Session=None, sample_size=SAMPLE_SIZE, cache_size=CACHE_SIZE, writer=None
+    ):
+        """
+        Args:
+            Session (): 数据库会话工厂, 为None时只在内存中缓存
+            writer (DBWriter): 写队列, 为None时检测结果不保存到数据库
+            sample_size (int): 编码检测使用的最大字节数
+            cache_size (int): 内存中缓存的条目数
+        """
+        self.Session = Session
+        self.writer = writer
+        self.sample_size = sample_size
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"bom": 0, "utf-8": 0, "cached": 0, "gbk": 0, "detected": 0}
+
+    def decode_file(self, path):
+        with open(path, "rb") as f:
+            return self.decode(f.read())[0]
+
+    def decode(self, data):
+        """
+        Returns:
+            tuple: (文本, 编码)
+        """
+        for bom, encoding in BOMS:
+            if data.startswith(bom):
+                self.stats["bom"] += 1
+                return data.decode(encoding, errors="ignore"), encoding
+        try:
+            text = data.decode("utf-8")
+            self.stats["utf-8"] += 1
+            return text, "utf-8"
+        except UnicodeDecodeError:
+            pass
+        digest = hashlib.sha256(data).hexdigest()
+        encoding = self.get(digest)
+        if encoding:
+            self.stats["cached"] += 1
+            return data.decode(encoding, errors="ignore"), encoding
+        text = self.try_gbk(data)
+        if text is not None:
+            self.stats["gbk"] += 1
+            encoding = "gbk"
+        else:
+            self.stats["detected"] += 1
+            encoding = chardet.detect(data[: self.sample_size])["encoding"] or "utf-8"
+            try:
+                codecs.lookup(encoding)
+            except LookupError:
+                encoding = "utf-8"
+            text = data.decode(encoding, errors="ignore")
+        self.put(digest, encoding)
+        return text, encoding
+
+    def try_gbk(self, data):
+        """
+        只接受GB2312范围内的双字节, Shift-JIS等编码的首字节多在GBK扩展区, 可以据此排除;
+        含GBK扩展字符的文本交给编码检测
+        """
+        try:
+            text = data.decode("gb2312")
+        except UnicodeDecodeError:
+            return None
+        non_ascii = len(NON_ASCII.findall(text))
+        if len(CJK.findall(text)) < non_ascii * self.GBK_MIN_CJK_RATIO:
+            return None
+        return text
+
+    def get(self, digest):
+        with self._lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                return self._cache[digest]
+        if self.Session is None:
+            return None
+        session = self.Session()
+        try:
+            row = session.get(ReadmeEncodingModel, digest)
+            encoding = row.encoding if row else None
+        finally:
+            session.close()
+        if encoding:
+            self.remember(digest, encoding)
+        return encoding
+
+    def put(self, digest, encoding):
+        self.remember(digest, encoding)
+        if self.writer is None:
+            return
+        self.writer.submit(self._save, digest, encoding)
+
+    @staticmethod
+    def _save(session, digest, encoding):
+        session.merge(ReadmeEncodingModel(sha256=digest, encoding=encoding))
+
+    def remember(self, digest, encoding):
+        with self._lock:
+            self._cache[digest] = encoding
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
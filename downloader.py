@@ -0,0 +1,460 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+class DownloadCancelled(Exception):
+    """
+    下载被暂停或取消
+    """
+
+    def __init__(self, reason="cancel"):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CancelToken:
+    """
+    跨线程的暂停/取消标记, 下载器在每个分块之间检查
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason="cancel"):
+        """
+        Args:
+            reason (str): "pause" 保留已下载部分以便续传, "cancel" 丢弃
+        """
+        self.reason = reason
+        self.event.set()
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise DownloadCancelled(self.reason)
+
+
+class FileDownloader:
+    """
+    流式下载器, 按固定大小分块写入预分配的文件, 边下载边计算哈希并回报进度;
+    未完成的下载在旁边保存状态文件, 重试或重启后通过Range请求续传;
+    大文件且服务器支持Range时可分段并行下载, 分段下载同样记录每段的进度以便续传
+    """
+
+    CHUNK_SIZE = 256 * 1024
+    # 进度回调和状态保存的最小间隔(秒)
+    PROGRESS_INTERVAL = 0.2
+    STATE_SUFFIX = ".state.json"
+    # 可以续传的网络错误
+    RETRY_ERRORS = (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    )
+
+    def __init__(
+        self,
+        http,
+        chunk_size=CHUNK_SIZE,
+        progress=None,
+        retries=3,
+        segments=1,
+        segment_threshold=8 * 1024 * 1024,
+        cancel=None,
+        sink=None,
+    ):
+        """
+        Args:
+            http (HttpClient): 共享的HTTP客户端
+            chunk_size (int): 每次读取写入的字节数
+            progress (callable): progress(已接收字节, 总字节, 速度字节/秒), 总字节未知时为0
+            retries (int): 传输中断后的续传次数, 分段下载时为每段的重试次数
+            segments (int): 分段下载的连接数, 1为不分段
+            segment_threshold (int): 文件超过该字节数才分段下载
+            cancel (CancelToken): 暂停/取消标记
+            sink: 按顺序接收文件内容的对象, 需提供reset()和feed(data), 分段下载时不使用
+        """
+        self.http = http
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.retries = retries
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.cancel = cancel or CancelToken()
+        self.sink = sink
+
+    @staticmethod
+    def preallocate(fp, size):
+        """
+        预先分配文件空间, 减少碎片并尽早发现磁盘空间不足
+        """
+        if size <= 0:
+            return
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(fp.fileno(), 0, size)
+        else:
+            fp.truncate(size)
+
+    def load_state(self, url, path):
+        """
+        读取续传状态, 与url不匹配或文件已丢失时返回None
+        """
+        state_path = path + self.STATE_SUFFIX
+        if not (os.path.exists(state_path) and os.path.exists(path)):
+            return None
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("url") != url or not (state.get("etag") or state.get("last_modified")):
+            return None
+        if os.path.getsize(path) < state.get("received", 0):
+            return None
+        return state
+
+    def save_state(self, path, state):
+        state_path = path + self.STATE_SUFFIX
+        with open(state_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(state_path + ".tmp", state_path)
+
+    def clear_state(self, path):
+        state_path = path + self.STATE_SUFFIX
+        if os.path.exists(state_path):
+            os.remove(state_path)
+
+    def hash_existing(self, path, size, feed=True):
+        """
+        续传时先对已下载的部分计算哈希
+
+        Args:
+            feed (bool): 是否同时把内容交给sink
+        """
+        digest = hashlib.sha256()
+        remaining = size
+        with open(path, "rb") as fp:
+            while remaining > 0:
+                chunk = fp.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError("续传文件比记录的短")
+                digest.update(chunk)
+                if feed and self.sink:
+                    self.sink.feed(chunk)
+                remaining -= len(chunk)
+        return digest
+
+    def download(self, url, path, headers=None):
+        """
+        下载url到path, 存在匹配的续传状态时从断点继续
+
+        Returns:
+            dict: {"size": 字节数, "sha256": 内容哈希, "elapsed": 耗时秒,
+                "resumed": 续传起点, "segments": 分段数,
+                "etag": ETag, "last_modified": Last-Modified,
+                "streamed": 是否已把完整内容交给sink}
+        """
+        t1 = time.perf_counter()
+        self.cancel.check()
+        state = self.load_state(url, path)
+        if state and state.get("segments"):
+            # 上次是分段下载, 服务器上的文件没有变化时继续下载各段剩余部分
+            probe = self.probe(url, headers)
+            if probe and probe[:2] == (state["total"], state["validator"]):
+                result = self._download_segmented(url, path, headers, *probe, state=state)
+                result["elapsed"] = time.perf_counter() - t1
+                return result
+            self.clear_state(path)
+            state = None
+        if self.segments > 1 and state is None:
+            probe = self.probe(url, headers)
+            if probe:
+                result = self._download_segmented(url, path, headers, *probe)
+                result["elapsed"] = time.perf_counter() - t1
+                return result
+        attempt = 0
+        resumed = None
+        while True:
+            state = self.load_state(url, path)
+            try:
+                result = self._download(url, path, headers, state)
+            except self.RETRY_ERRORS as err:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                print(f"下载中断, 第{attempt}次续传: {err}")
+                continue
+            if resumed is None:
+                resumed = result["resumed"]
+            result["resumed"] = resumed
+            result["segments"] = 1
+            result["streamed"] = self.sink is not None
+            result["elapsed"] = time.perf_counter() - t1
+            return result
+
+    def _download(self, url, path, headers, state):
+        headers = dict(headers or {})
+        offset = 0
+        if state:
+            offset = state.get("received", 0)
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = state.get("etag") or state.get("last_modified")
+        t1 = last = time.perf_counter()
+        with self.http.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 416:
+                # 范围无效, 丢弃旧文件重新下载
+                self.clear_state(path)
+                raise requests.ConnectionError("续传范围无效")
+            response.raise_for_status()
+            total = 0
+            if response.status_code == 206:
+                match = re.match(
+                    r"bytes (\d+)-\d+/(\d+|\*)", response.headers.get("Content-Range", "")
+                )
+                if not match or int(match.group(1)) != offset:
+                    self.clear_state(path)
+                    raise requests.ConnectionError("服务器返回的续传范围不一致")
+                total = int(match.group(2)) if match.group(2) != "*" else 0
+            else:
+                # 服务器不支持续传或文件已变化, 从头下载
+                offset = 0
+                total = int(response.headers.get("Content-Length") or 0)
+                # 压缩传输时Content-Length不是文件大小
+                if response.headers.get("Content-Encoding"):
+                    total = 0
+            if self.sink:
+                self.sink.reset()
+            digest = self.hash_existing(path, offset) if offset else hashlib.sha256()
+            state = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "total": total,
+                "received": offset,
+            }
+            can_resume = bool(state["etag"] or state["last_modified"])
+            received = offset
+            with open(path, "r+b" if offset else "wb") as fp:
+                if not offset:
+                    self.preallocate(fp, total)
+                fp.seek(offset)
+                try:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        self.cancel.check()
+                        if not chunk:
+                            continue
+                        fp.write(chunk)
+                        digest.update(chunk)
+                        if self.sink:
+                            self.sink.feed(chunk)
+                        received += len(chunk)
+                        now = time.perf_counter()
+                        if now - last >= self.PROGRESS_INTERVAL:
+                            last = now
+                            if can_resume:
+                                fp.flush()
+                                state["received"] = received
+                                self.save_state(path, state)
+                            if self.progress:
+                                self.progress(
+                                    received, total, (received - offset) / max(now - t1, 1e-6)
+                                )
+                finally:
+                    if can_resume:
+                        fp.flush()
+                        state["received"] = received
+                        self.save_state(path, state)
+                if total and received < total:
+                    raise requests.ConnectionError(f"下载不完整: {received}/{total}")
+                fp.truncate(received)
+        self.clear_state(path)
+        elapsed = time.perf_counter() - t1
+        if self.progress:
+            self.progress(received, total or received, (received - offset) / max(elapsed, 1e-6))
+        return {
+            "size": received,
+            "sha256": digest.hexdigest(),
+            "elapsed": elapsed,
+            "resumed": offset,
+            "etag": state["etag"],
+            "last_modified": state["last_modified"],
+        }
+
+    def remote_version(self, url, headers=None):
+        """
+        用HEAD请求获取服务器上文件的当前版本, 失败时返回None
+
+        Returns:
+            tuple: (总字节, ETag, Last-Modified)
+        """
+        try:
+            response = self.http.head(url, headers=headers, allow_redirects=True)
+        except requests.RequestException as err:
+            print(f"探测{url}失败: {err}")
+            return None
+        if response.status_code != 200:
+            return None
+        return (
+            int(response.headers.get("Content-Length") or 0),
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+
+    def probe(self, url, headers=None):
+        """
+        检查是否适合分段下载
+
+        Returns:
+            tuple: (总字节, 校验值, ETag, Last-Modified), 不支持Range、文件过小或没有校验值时返回None
+        """
+        try:
+            response = self.http.head(url, headers=headers, allow_redirects=True)
+        except requests.RequestException as err:
+            print(f"探测{url}失败: {err}")
+            return None
+        if response.status_code != 200:
+            return None
+        if response.headers.get("Accept-Ranges", "").lower() != "bytes":
+            return None
+        total = int(response.headers.get("Content-Length") or 0)
+        validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        if total <= self.segment_threshold or not validator:
+            return None
+        return (
+            total,
+            validator,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+
+    def _download_segmented(
+        self, url, path, headers, total, validator, etag, last_modified, state=None
+    ):
+        """
+        分段并行下载, 状态文件中记录每段 [起点, 终点, 已写入位置], state不为None时从中继续
+        """
+        if state is None:
+            self.clear_state(path)
+            size = -(-total // self.segments)
+            segments = [
+                [start, min(start + size, total) - 1, start] for start in range(0, total, size)
+            ]
+            with open(path, "wb") as fp:
+                self.preallocate(fp, total)
+        else:
+            segments = state["segments"]
+        state = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "total": total,
+            "validator": validator,
+            "segments": segments,
+        }
+        self.save_state(path, state)
+        resumed = sum(position - start for start, _, position in segments)
+        lock = threading.Lock()
+        done = [resumed]
+        t1 = time.perf_counter()
+        last = [t1]
+
+        def report(index, position, n):
+            with lock:
+                segments[index][2] = position
+                done[0] += n
+                now = time.perf_counter()
+                if now - last[0] >= self.PROGRESS_INTERVAL:
+                    last[0] = now
+                    self.save_state(path, state)
+                    if self.progress:
+                        self.progress(done[0], total, (done[0] - resumed) / max(now - t1, 1e-6))
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+                futures = [
+                    pool.submit(
+                        self._fetch_segment, url, path, headers, validator, index, segment, report
+                    )
+                    for index, segment in enumerate(segments)
+                    if segment[2] <= segment[1]
+                ]
+                for future in futures:
+                    future.result()
+        except (DownloadCancelled,) + self.RETRY_ERRORS:
+            # 暂停或网络中断, 保存各段进度以便续传
+            with lock:
+                self.save_state(path, state)
+            raise
+        except Exception:
+            # 文件在服务器上已变化或写入出错, 下次从头下载
+            self.clear_state(path)
+            raise
+        received = sum(position - start for start, _, position in segments)
+        # 完整性校验: 每段字节数相加与文件大小都必须等于总大小
+        if received != total or os.path.getsize(path) != total:
+            self.clear_state(path)
+            raise IOError(f"分段下载不完整: {received}/{total}")
+        self.clear_state(path)
+        # 分段下载不使用sink, 调用方会从文件解压
+        digest = self.hash_existing(path, total, feed=False)
+        elapsed = time.perf_counter() - t1
+        if self.progress:
+            self.progress(total, total, (total - resumed) / max(elapsed, 1e-6))
+        return {
+            "size": total,
+            "sha256": digest.hexdigest(),
+            "elapsed": elapsed,
+            "resumed": resumed,
+            "segments": len(segments),
+            "streamed": False,
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+
+    def _fetch_segment(self, url, path, headers, validator, index, segment, report):
+        """
+        下载segment记录的剩余范围写入文件对应位置, 中断时从已写入的位置重试
+        """
+        start, end, position = segment
+        attempt = 0
+        while position <= end:
+            segment_headers = dict(headers or {})
+            segment_headers["Range"] = f"bytes={position}-{end}"
+            segment_headers["If-Range"] = validator
+            try:
+                with self.http.get(url, headers=segment_headers, stream=True) as response:
+                    if response.status_code != 206 or not response.headers.get(
+                        "Content-Range", ""
+                    ).startswith(f"bytes {position}-"):
+                        # 文件在下载过程中变化或服务器不再支持Range
+                        raise IOError(f"分段响应无效: {response.status_code}")
+                    with open(path, "r+b") as fp:
+                        fp.seek(position)
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            self.cancel.check()
+                            chunk = chunk[: end + 1 - position]
+                            if not chunk:
+                                continue
+                            fp.write(chunk)
+                            # 先写入文件再记录进度, 状态文件中的位置不会超过实际写入的数据
+                            fp.flush()
+                            position += len(chunk)
+                            report(index, position, len(chunk))
+                if position <= end:
+                    raise requests.ConnectionError(f"分段提前结束: {position}/{end + 1}")
+            except self.RETRY_ERRORS as err:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                print(f"分段{start}-{end}中断, 第{attempt}次重试: {err}")
+        return position - start
@@ -0,0 +1,315 @@
+import fnmatch
+import os
+import shutil
+import struct
+import zipfile
+import zlib
+
+import rarfile
+
+
+class ExtractError(Exception):
+    """
+    压缩包无法解压
+    """
+
+
+def safe_join(dest, name):
+    """
+    拼接成员路径, 拒绝绝对路径和跳出目标目录的成员
+    """
+    name = name.replace("\\", "/").lstrip("/")
+    parts = [p for p in name.split("/") if p not in ("", ".")]
+    if not parts or ".." in parts or ":" in parts[0]:
+        return None
+    return os.path.join(dest, *parts)
+
+
+class ExtractRules:
+    """
+    选择性解压的规则, 按成员文件名(不含目录, 不区分大小写)匹配通配符
+    """
+
+    def __init__(self, trainer=(), include=()):
+        """
+        Args:
+            trainer (list): 修改器主程序的匹配规则
+            include (list): 一并解压的readme和依赖文件的匹配规则
+        """
+        self.trainer = [p.lower() for p in trainer]
+        self.include = [p.lower() for p in include]
+
+    @staticmethod
+    def basename(name):
+        return name.replace("\\", "/").rstrip("/").rsplit("/", 1)[-1].lower()
+
+    def is_trainer(self, name):
+        base = self.basename(name)
+        return any(fnmatch.fnmatchcase(base, p) for p in self.trainer)
+
+    def matches(self, name):
+        base = self.basename(name)
+        return any(fnmatch.fnmatchcase(base, p) for p in self.trainer + self.include)
+
+    def select(self, names):
+        """
+        Returns:
+            set: 需要解压的成员名, 没有找到修改器时返回None表示全部解压
+        """
+        if not any(self.is_trainer(n) for n in names):
+            return None
+        return {n for n in names if self.matches(n)}
+
+
+class ArchiveExtractor:
+    """
+    在进程内用zipfile/rarfile逐个成员解压, 每个成员按固定大小分块写出
+    """
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, chunk_size=CHUNK_SIZE, unrar_tool=None):
+        """
+        Args:
+            chunk_size (int): 每次读取写入的字节数
+            unrar_tool (str): rarfile使用的解压程序, 为None时在PATH中查找unrar/unar/bsdtar
+        """
+        self.chunk_size = chunk_size
+        if unrar_tool:
+            rarfile.UNRAR_TOOL = unrar_tool
+
+    @staticmethod
+    def open(archive_path, file_type=None):
+        """
+        按扩展名或文件内容打开压缩包
+        """
+        if file_type == "zip" or (file_type is None and zipfile.is_zipfile(archive_path)):
+            return zipfile.ZipFile(archive_path)
+        if file_type == "rar" or (file_type is None and rarfile.is_rarfile(archive_path)):
+            return rarfile.RarFile(archive_path)
+        raise ExtractError(f"不支持的压缩格式: {file_type}")
+
+    def extract(self, archive_path, dest, file_type=None, rules=None):
+        """
+        解压成员到dest, 指定rules时只解压规则选中的成员, 规则没有选中修改器时全部解压
+
+        Returns:
+            list: 解压出的成员名
+        """
+        names = []
+        try:
+            with self.open(archive_path, file_type) as archive:
+                infos = archive.infolist()
+                selected = None
+                if rules:
+                    selected = rules.select([i.filename for i in infos if not i.is_dir()])
+                for info in infos:
+                    name = info.filename
+                    if selected is not None and name not in selected:
+                        continue
+                    target = safe_join(dest, name)
+                    if target is None:
+                        print(f"跳过不安全的路径: {name}")
+                        continue
+                    if info.is_dir():
+                        os.makedirs(target, exist_ok=True)
+                        continue
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with archive.open(info) as src, open(target, "wb") as dst:
+                        shutil.copyfileobj(src, dst, self.chunk_size)
+                    names.append(name)
+        except (zipfile.BadZipFile, rarfile.Error) as err:
+            raise ExtractError(str(err)) from err
+        return names
+
+
+class ZipStreamExtractor:
+    """
+    在zip下载过程中按本地文件头顺序解压成员, 只支持未加密的存储/deflate成员;
+    遇到不支持的情况时停止, 由调用方在下载完成后从文件重新解压;
+    指定rules时只写出规则匹配的成员, 规则最终没有选中修改器时也需要重新全部解压
+    """
+
+    LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+    LOCAL_SIG = 0x04034B50
+    CENTRAL_SIG = 0x02014B50
+    END_SIG = 0x06054B50
+    DESCRIPTOR_SIG = 0x08074B50
+    FLAG_ENCRYPTED = 0x1
+    FLAG_DESCRIPTOR = 0x8
+    FLAG_UTF8 = 0x800
+
+    def __init__(self, dest, chunk_size=ArchiveExtractor.CHUNK_SIZE, rules=None):
+        self.dest = dest
+        self.chunk_size = chunk_size
+        self.rules = rules
+        self.reset()
+
+    def reset(self):
+        """
+        丢弃已解压的内容, 下载从头开始时调用
+        """
+        self.close_entry()
+        if os.path.exists(self.dest):
+            shutil.rmtree(self.dest, ignore_errors=True)
+        self.buffer = b""
+        self.entry = None
+        self.names = []
+        self.done = False
+        self.failed = None
+
+    def close_entry(self):
+        entry = getattr(self, "entry", None)
+        if entry and entry["fp"]:
+            entry["fp"].close()
+
+    def fail(self, reason):
+        self.close_entry()
+        self.entry = None
+        self.buffer = b""
+        self.failed = reason
+
+    def feed(self, data):
+        if self.done or self.failed:
+            return
+        self.buffer += data
+        try:
+            while not self.done and not self.failed:
+                if self.entry is None:
+                    if not self.read_header():
+                        break
+                elif not self.read_data():
+                    break
+        except (OSError, zlib.error, UnicodeDecodeError) as err:
+            self.fail(str(err))
+
+    def read_header(self):
+        if len(self.buffer) < 4:
+            return False
+        (sig,) = struct.unpack_from("<I", self.buffer)
+        if sig in (self.CENTRAL_SIG, self.END_SIG):
+            # 成员数据已结束, 后面是中央目录
+            self.done = True
+            self.buffer = b""
+            return False
+        if sig != self.LOCAL_SIG:
+            self.fail("无法识别的本地文件头")
+            return False
+        size = self.LOCAL_HEADER.size
+        if len(self.buffer) < size:
+            return False
+        (_, _, flags, method, _, _, crc, csize, usize, nlen, elen) = (
+            self.LOCAL_HEADER.unpack_from(self.buffer)
+        )
+        if len(self.buffer) < size + nlen + elen:
+            return False
+        raw_name = self.buffer[size : size + nlen]
+        name = raw_name.decode("utf-8" if flags & self.FLAG_UTF8 else "cp437")
+        self.buffer = self.buffer[size + nlen + elen :]
+        if flags & self.FLAG_ENCRYPTED:
+            self.fail(f"{name}已加密")
+            return False
+        if 0xFFFFFFFF in (csize, usize):
+            self.fail(f"{name}是zip64成员")
+            return False
+        descriptor = bool(flags & self.FLAG_DESCRIPTOR)
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) or (
+            method == zipfile.ZIP_STORED and descriptor
+        ):
+            self.fail(f"{name}的压缩方式不支持边下载边解压")
+            return False
+        target = safe_join(self.dest, name)
+        if target is None:
+            self.fail(f"{name}路径不安全")
+            return False
+        # 规则没有选中的成员只校验不写出
+        fp = None
+        if name.endswith("/"):
+            if not self.rules:
+                os.makedirs(target, exist_ok=True)
+        elif not self.rules or self.rules.matches(name):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fp = open(target, "wb")
+        self.entry = {
+            "name": name,
+            "fp": fp,
+            "method": method,
+            "descriptor": descriptor,
+            "crc": crc,
+            "remaining": csize,
+            "actual_crc": 0,
+            "inflater": zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None,
+        }
+        return True
+
+    def write(self, data):
+        entry = self.entry
+        entry["actual_crc"] = zlib.crc32(data, entry["actual_crc"])
+        if entry["fp"]:
+            entry["fp"].write(data)
+
+    def read_data(self):
+        entry = self.entry
+        if entry["inflater"] is None:
+            take = self.buffer[: entry["remaining"]]
+            self.buffer = self.buffer[len(take) :]
+            entry["remaining"] -= len(take)
+            self.write(take)
+            if entry["remaining"]:
+                return False
+        elif not entry["inflater"].eof:
+            data = self.buffer
+            if not entry["descriptor"]:
+                data = data[: entry["remaining"]]
+                entry["remaining"] -= len(data)
+            self.buffer = self.buffer[len(data) :]
+            inflater = entry["inflater"]
+            while data and not inflater.eof:
+                self.write(inflater.decompress(data, self.chunk_size))
+                data = inflater.unconsumed_tail
+            if inflater.eof:
+                # 解压流结束后多读的数据属于下一个头; 限制输出长度时unconsumed_tail
+                # 与unused_data是同一段数据, 只放回unused_data
+                self.buffer = inflater.unused_data + self.buffer
+            else:
+                return False
+        if entry["descriptor"]:
+            if len(self.buffer) < 16:
+                return False
+            (sig,) = struct.unpack_from("<I", self.buffer)
+            offset = 4 if sig == self.DESCRIPTOR_SIG else 0
+            (entry["crc"],) = struct.unpack_from("<I", self.buffer, offset)
+            self.buffer = self.buffer[offset + 12 :]
+        self.close_entry()
+        self.entry = None
+        if entry["actual_crc"] != entry["crc"]:
+            self.fail(f"{entry['name']}校验失败")
+            return False
+        if entry["fp"]:
+            self.names.append(entry["name"])
+        return True
+
+    def finish(self, archive_path):
+        """
+        下载完成后与中央目录核对, 全部成员都已正确解压时返回True
+        """
+        if self.failed or not self.done:
+            if not self.failed:
+                self.fail("压缩包数据不完整")
+            return False
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                expected = [i.filename for i in archive.infolist() if not i.is_dir()]
+        except zipfile.BadZipFile as err:
+            self.fail(str(err))
+            return False
+        if self.rules:
+            selected = self.rules.select(expected)
+            if selected is None:
+                self.fail("规则没有选中修改器")
+                return False
+            expected = selected
+        if sorted(expected) != sorted(self.names):
+            self.fail("解压结果与中央目录不一致")
+            return False
+        return True
@@ -0,0 +1,74 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class HttpClient:
+    """
+    共享的HTTP客户端, 复用连接池, 统一超时和幂等请求的重试
+    """
+
+    RETRY_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, timeout=(10, 60), retries=3, backoff=0.5, pool_size=8):
+        """
+        Args:
+            timeout (tuple): (连接超时, 读取超时) 秒
+            retries (int): 幂等请求的最大重试次数
+            backoff (float): 重试退避系数, 第n次重试前等待 backoff * 2**(n-1) 秒
+            pool_size (int): 每个主机的最大连接数
+        """
+        self.timeout = timeout
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=self.RETRY_STATUS,
+            allowed_methods=self.RETRY_METHODS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def prewarm(self, urls):
+        """
+        后台预先建立到各主机的连接, 失败时忽略
+        """
+
+        def run():
+            hosts = {}
+            for url in urls:
+                parts = urlsplit(url)
+                hosts.setdefault(parts.netloc, f"{parts.scheme}://{parts.netloc}/")
+            for url in hosts.values():
+                try:
+                    self.head(url, allow_redirects=False).close()
+                except requests.RequestException as err:
+                    print(f"预连接{url}失败: {err}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import stat
+import threading
+import time
+
+
+class Installer:
+    """
+    在下载目录下的临时目录中解压, 完成后一次重命名放到安装位置;
+    旧版本先重命名到回收目录再在后台删除, 中途中断不会影响已安装的版本
+    """
+
+    STAGING_SUFFIX = ".staging"
+    TRASH_DIR = "trash"
+
+    def __init__(self, root):
+        """
+        Args:
+            root (str): 下载目录, 临时目录和回收目录都在其中, 保证与安装位置在同一文件系统
+        """
+        self.root = root
+        self.temp_dir = os.path.join(root, "temp")
+        self.trash_dir = os.path.join(self.temp_dir, self.TRASH_DIR)
+
+    def staging(self, name):
+        """
+        返回一个空的临时解压目录, 清掉上次中断留下的内容
+        """
+        path = os.path.join(self.temp_dir, name + self.STAGING_SUFFIX)
+        if os.path.exists(path):
+            self.remove(path)
+        os.makedirs(path)
+        return path
+
+    def target(self, name, live=None, suffix=None):
+        """
+        选择安装目录, 与正在使用的目录相同时加后缀, 保证新版本不需要覆盖旧版本
+        """
+        path = os.path.join(self.root, name)
+        if live and os.path.normcase(os.path.abspath(path)) == os.path.normcase(
+            os.path.abspath(live)
+        ):
+            path = f"{path}-{suffix}"
+        return path
+
+    def activate(self, staging, target):
+        """
+        把解压好的目录重命名到安装位置, 该位置已有未在使用的旧内容时先移走
+        """
+        if os.path.exists(target):
+            self.retire(target)
+        os.rename(staging, target)
+        return target
+
+    def retire(self, path):
+        """
+        把不再使用的目录移到回收目录, 在后台删除
+        """
+        if not os.path.exists(path):
+            return
+        os.makedirs(self.trash_dir, exist_ok=True)
+        trash = os.path.join(
+            self.trash_dir, f"{os.path.basename(path.rstrip(os.sep))}.{time.time_ns()}"
+        )
+        os.rename(path, trash)
+        threading.Thread(target=self.remove, args=(trash,), daemon=True).start()
+
+    def purge(self):
+        """
+        在后台清理上次退出时没删完的回收目录, 临时解压目录在下次使用时清理
+        """
+        if not os.path.exists(self.trash_dir):
+            return None
+        paths = [os.path.join(self.trash_dir, name) for name in os.listdir(self.trash_dir)]
+
+        def run():
+            for path in paths:
+                self.remove(path)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def remove(path):
+        def onerror(func, target, _):
+            # Windows下只读文件需要先去掉只读属性
+            os.chmod(target, stat.S_IWRITE)
+            func(target)
+
+        try:
+            shutil.rmtree(path, onerror=onerror)
+        except OSError as err:
+            print(f"删除{path}失败: {err}")
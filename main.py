@@ -7,14 +7,24 @@ import shutil
 import stat
 import subprocess
 import sys
+import threading
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import NoReturn
-from urllib.request import urlretrieve
+from urllib.parse import urlsplit
 
-import chardet
-import requests
 from lxml import etree
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import (
+    QAbstractTableModel,
+    QEvent,
+    QModelIndex,
+    QObject,
+    Qt,
+    QThread,
+    QTimer,
+    pyqtSignal,
+)
 from PyQt5.QtGui import QIcon, QTextCursor
 from PyQt5.QtWidgets import (
     QAction,
@@ -25,22 +35,76 @@ from PyQt5.QtWidgets import (
     QFileDialog,
     QGridLayout,
     QHBoxLayout,
+    QHeaderView,
     QLabel,
     QLineEdit,
     QMenu,
     QMessageBox,
     QPushButton,
-    QTableWidget,
-    QTableWidgetItem,
+    QStyle,
+    QStyledItemDelegate,
+    QStyleOptionButton,
+    QTableView,
     QTextEdit,
+    QTreeWidget,
+    QTreeWidgetItem,
     QVBoxLayout,
     QWidget,
 )
-from sqlalchemy import create_engine
+from sqlalchemy import func, update
 from sqlalchemy.orm import sessionmaker
 
-from consts import GAME_NAME_MAP
-from db import Base, FlingTrainerAppModel
+from cache import AppInfoCache, ArchiveStore, PageCache
+from consts import (
+    APP_INFO_CACHE_SIZE,
+    APP_INFO_MAX_AGE,
+    ARCHIVE_CACHE_MB,
+    CATALOG_REFRESH_MINUTES,
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_MB,
+    DB_MMAP_MB,
+    DB_POOL_SIZE,
+    DB_WRITE_BATCH,
+    DOWNLOAD_CONCURRENCY,
+    DOWNLOAD_PER_HOST,
+    DOWNLOAD_SEGMENT_THRESHOLD,
+    DOWNLOAD_SEGMENTS,
+    EXTRACT_RULES,
+    GAME_NAME_MAP,
+    HTTP_POOL_SIZE,
+    HTTP_RETRIES,
+    HTTP_TIMEOUT,
+    PREFETCH_MINUTES,
+    PREFETCH_WORKERS,
+    SCHEDULER_RETRY,
+    SCHEDULER_TICK_MS,
+    SEARCH_DEBOUNCE_MS,
+    TRAINER_LIST_URL,
+    UPDATE_CHECK_MINUTES,
+)
+from decoder import ReadmeDecoder
+from db import (
+    Base,
+    DBWriter,
+    DownloadJobModel,
+    FlingTrainerAppModel,
+    backfill_derived_columns,
+    create_db_engine,
+    init_search_index,
+    load_readme,
+    migrate_readmes,
+    save_readme,
+    save_readmes,
+    search_apps,
+    sync_apps,
+    upgrade_schema,
+)
+from downloader import CancelToken, DownloadCancelled, FileDownloader
+from extractor import ArchiveExtractor, ExtractRules, ZipStreamExtractor
+from http_client import HttpClient
+from installer import Installer
+from relocator import Relocator
+from scheduler import Scheduler
 from utils import FlingCatTools
 
 
@@ -108,19 +172,445 @@ class SettingsDialog(QDialog):
 
 class Worker(QThread):
     finished = pyqtSignal()
-    progress = pyqtSignal(str)
+    # 已接收字节, 总字节, 速度(字节/秒)
+    progress = pyqtSignal("qint64", "qint64", float)
 
-    def __init__(self, func, *args):
+    def __init__(self, func, *args, withProgress=False, **kwargs):
         super().__init__()
         self.func = func
         self.args = args
+        self.kwargs = kwargs
+        self.withProgress = withProgress
+        self.result = None
 
     def run(self):
-        self.func(*self.args)
+        if self.withProgress:
+            self.kwargs["progress"] = self.progress.emit
+        self.result = self.func(*self.args, **self.kwargs)
         self.finished.emit()
 
 
+class DownloadQueue(QObject):
+    """
+    下载队列: 按优先级调度, 限制总并发和单主机并发, 支持暂停/继续/取消,
+    未完成的任务保存在数据库中, 重启后继续
+    """
+
+    PRIORITY_USER = 0
+    PRIORITY_BACKGROUND = 10
+    ACTIVE = ("queued", "running", "paused")
+    # 任务因DownloadCancelled结束时runner返回err.reason
+    REASON_STATUS = {"pause": "paused", "cancel": "cancelled"}
+    # runJob发现主机已满时返回, 任务重新排队
+    REQUEUE = "requeue"
+
+    jobChanged = pyqtSignal(int)
+    # 任务id, 已接收字节, 总字节, 速度(字节/秒)
+    jobProgress = pyqtSignal(int, "qint64", "qint64", float)
+    jobFinished = pyqtSignal(int, str)
+    # 任务id, 压缩包所在的主机
+    hostResolved = pyqtSignal(int, str)
+
+    def __init__(
+        self, Session, writer, runners, concurrency=2, perHost=2, resolveHost=None, parent=None
+    ):
+        """
+        Args:
+            Session (): 数据库会话工厂, 只用于读取
+            writer (DBWriter): 写队列, 与其他写操作共用同一个
+            runners (dict): {任务类型: func(app_id, progress=, cancel=)}, 返回"done"或"failed"
+            concurrency (int): 同时进行的任务数
+            perHost (int): 同一主机同时进行的任务数
+            resolveHost (callable): func(app_id), 返回压缩包下载地址的主机, 在任务开始时于工作线程中调用
+        """
+        super().__init__(parent)
+        self.Session = Session
+        self.writer = writer
+        self.runners = runners
+        self.concurrency = concurrency
+        self.perHost = perHost
+        self.resolveHost = resolveHost
+        self.jobs = {}
+        self.workers = {}
+        # 各主机正在执行的任务数, 由工作线程维护
+        self.hostCounts = Counter()
+        self.hostLock = threading.Lock()
+        self.hostResolved.connect(self.onHostResolved)
+        # 任务id在内存中分配, 加入队列时不需要等待写入数据库
+        self.lastJobId = None
+        # 为True时不开始新任务, 如移动下载目录期间
+        self.held = False
+
+    def restore(self):
+        """
+        加载上次未完成的任务, 中断时正在进行的任务重新排队
+        """
+        session = self.Session()
+        rows = (
+            session.query(DownloadJobModel, FlingTrainerAppModel)
+            .join(FlingTrainerAppModel, FlingTrainerAppModel.id == DownloadJobModel.app_id)
+            .filter(DownloadJobModel.status.in_(self.ACTIVE))
+            .all()
+        )
+        for job, app in rows:
+            self.jobs[job.id] = {
+                "id": job.id,
+                "app_id": job.app_id,
+                "name": app.name_zh or app.name_en,
+                "kind": job.kind,
+                "priority": job.priority,
+                "status": "queued" if job.status == "running" else job.status,
+                "host": job.host,
+                "created_at": job.created_at,
+            }
+        session.close()
+        self.writer.submit(
+            lambda session: session.query(DownloadJobModel)
+            .filter_by(status="running")
+            .update({"status": "queued"})
+        )
+        for jobId in self.jobs:
+            self.jobChanged.emit(jobId)
+        self.schedule()
+
+    def enqueue(self, app_id, kind, name, priority=PRIORITY_USER):
+        """
+        加入队列, 同一应用已有未完成的同类任务时只提升其优先级
+        """
+        for job in self.jobs.values():
+            if job["app_id"] == app_id and job["kind"] == kind:
+                if priority < job["priority"]:
+                    job["priority"] = priority
+                    self.save(job)
+                if job["status"] == "paused" and priority == self.PRIORITY_USER:
+                    self.resume(job["id"])
+                self.schedule()
+                return job["id"]
+        job = {
+            "id": self.nextJobId(),
+            "app_id": app_id,
+            "name": name,
+            "kind": kind,
+            "priority": priority,
+            "status": "queued",
+            # 任务开始时才能确定
+            "host": None,
+            "created_at": time.time(),
+        }
+        self.writer.submit(self.insert, {k: v for k, v in job.items() if k != "name"})
+        self.jobs[job["id"]] = job
+        self.jobChanged.emit(job["id"])
+        self.schedule()
+        return job["id"]
+
+    def nextJobId(self):
+        if self.lastJobId is None:
+            session = self.Session()
+            self.lastJobId = session.query(func.max(DownloadJobModel.id)).scalar() or 0
+            session.close()
+        self.lastJobId += 1
+        return self.lastJobId
+
+    @staticmethod
+    def insert(session, values):
+        session.add(DownloadJobModel(**values))
+
+    def save(self, job):
+        values = {"status": job["status"], "priority": job["priority"], "host": job["host"]}
+        self.writer.submit(
+            lambda session: session.query(DownloadJobModel)
+            .filter_by(id=job["id"])
+            .update(values)
+        )
+
+    def setStatus(self, jobId, status):
+        job = self.jobs[jobId]
+        job["status"] = status
+        if status in self.ACTIVE:
+            self.save(job)
+        else:
+            # 结束的任务不再保留
+            self.writer.submit(
+                lambda session: session.query(DownloadJobModel).filter_by(id=jobId).delete()
+            )
+            del self.jobs[jobId]
+        self.jobChanged.emit(jobId)
+
+    def hold(self, held):
+        """
+        暂停或恢复调度, 已在进行的任务不受影响
+        """
+        self.held = held
+        if not held:
+            self.schedule()
+
+    def schedule(self):
+        if self.held:
+            return
+        # 主机在任务开始时确定, 之后重新排队的任务据此跳过; 实际的限制在runJob中
+        hosts = Counter(self.jobs[jobId]["host"] for jobId in self.workers)
+        queued = sorted(
+            (job for job in self.jobs.values() if job["status"] == "queued"),
+            key=lambda job: (job["priority"], job["created_at"]),
+        )
+        for job in queued:
+            if len(self.workers) >= self.concurrency:
+                break
+            if job["host"] is not None and hosts[job["host"]] >= self.perHost:
+                continue
+            hosts[job["host"]] += 1
+            self.start(job)
+
+    def start(self, job):
+        jobId = job["id"]
+        token = CancelToken()
+        worker = Worker(
+            self.runJob, jobId, job["kind"], job["app_id"], withProgress=True, cancel=token
+        )
+        worker.progress.connect(
+            lambda received, total, speed, jobId=jobId: self.jobProgress.emit(
+                jobId, received, total, speed
+            )
+        )
+        worker.finished.connect(lambda jobId=jobId: self.onWorkerFinished(jobId))
+        self.workers[jobId] = (worker, token)
+        self.setStatus(jobId, "running")
+        worker.start()
+
+    def runJob(self, jobId, kind, app_id, progress=None, cancel=None):
+        """
+        在工作线程中执行: 先确定压缩包所在的主机, 该主机的任务数已满时不等待,
+        返回REQUEUE让出位置, 由schedule在该主机有空位时再开始
+        """
+        host = ""
+        if self.resolveHost is not None:
+            try:
+                host = self.resolveHost(app_id) or ""
+            except Exception:
+                # 获取详情失败时任务本身也会失败并记录错误
+                pass
+        self.hostResolved.emit(jobId, host)
+        with self.hostLock:
+            if self.hostCounts[host] >= self.perHost:
+                return self.REQUEUE
+            self.hostCounts[host] += 1
+        try:
+            return self.runners[kind](app_id, progress=progress, cancel=cancel)
+        finally:
+            with self.hostLock:
+                self.hostCounts[host] -= 1
+
+    def onHostResolved(self, jobId, host):
+        job = self.jobs.get(jobId)
+        if job is not None and job["host"] != host:
+            job["host"] = host
+            self.save(job)
+
+    def onWorkerFinished(self, jobId):
+        if jobId not in self.workers:
+            return
+        worker, token = self.workers.pop(jobId)
+        worker.wait()
+        # 以任务的返回值为准: 下载完成后才暂停/取消时任务已经安装完成
+        result = worker.result
+        if result == self.REQUEUE:
+            if not token.is_set():
+                # 主机已在onHostResolved中记录, schedule会跳过它直到该主机有空位
+                self.setStatus(jobId, "queued")
+                self.schedule()
+                return
+            # 任务没有执行就被暂停/取消
+            result = token.reason
+            if result == "cancel" and "discard" in self.runners:
+                self.runners["discard"](self.jobs[jobId]["app_id"])
+        status = self.REASON_STATUS.get(result, result or "failed")
+        self.setStatus(jobId, status)
+        self.jobFinished.emit(jobId, status)
+        self.schedule()
+
+    def pause(self, jobId):
+        job = self.jobs.get(jobId)
+        if not job:
+            return
+        if job["status"] == "running":
+            self.workers[jobId][1].cancel("pause")
+        elif job["status"] == "queued":
+            self.setStatus(jobId, "paused")
+
+    def resume(self, jobId):
+        job = self.jobs.get(jobId)
+        if job and job["status"] == "paused":
+            self.setStatus(jobId, "queued")
+            self.schedule()
+
+    def cancel(self, jobId):
+        job = self.jobs.get(jobId)
+        if not job:
+            return
+        if job["status"] == "running":
+            self.workers[jobId][1].cancel("cancel")
+        else:
+            if job["status"] == "paused" and "discard" in self.runners:
+                # 丢弃暂停时保留的部分文件
+                self.runners["discard"](job["app_id"])
+            self.setStatus(jobId, "cancelled")
+            self.jobFinished.emit(jobId, "cancelled")
+
+    def shutdown(self):
+        """
+        退出时暂停正在进行的任务, 下次启动后续传
+        """
+        for worker, token in list(self.workers.values()):
+            token.cancel("pause")
+        for worker, token in list(self.workers.values()):
+            worker.wait()
+
+
+class FlingTrainerTableModel(QAbstractTableModel):
+    """
+    应用列表数据模型, 只保存轻量的行数据, 显示内容在绘制时按需生成
+    """
+
+    COLUMNS = ["名称", "提示", "管理", "操作"]
+    IdRole = Qt.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            if index.column() == 0:
+                return self.displayName(row)
+            return self.buttonText(row, index.column())
+        if role == Qt.UserRole:
+            return row["page_url"]
+        if role == self.IdRole:
+            return row["id"]
+        return None
+
+    @staticmethod
+    def displayName(row):
+        name = f"{row['name_zh']}({row['name_en']})" if row["name_zh"] else row["name_en"]
+        return f"{'🔥' if row['is_hot'] else ''}{'🆕' if row['is_new'] else ''}{name}{'(已下架)' if row['is_removed'] else ''}"
+
+    @staticmethod
+    def buttonText(row, column):
+        """
+        按钮列显示的文字, 返回None表示该单元格没有按钮
+        """
+        if column == 1:
+            return "点我!" if row["download"] and row["has_readme"] else None
+        if column == 2:
+            if not row["download"]:
+                return None
+            return "有更新" if row.get("has_update") else "管理"
+        if column == 3:
+            return "打开" if row["download"] else "下载"
+        return None
+
+    def setRows(self, rows):
+        """
+        替换列表数据, 行顺序不变时只通知变化的行, 否则重置模型
+        """
+        if [r["id"] for r in rows] != [r["id"] for r in self.rows]:
+            self.beginResetModel()
+            self.rows = rows
+            self.endResetModel()
+            return
+        old_rows, self.rows = self.rows, rows
+        for rowIndex, (old, new) in enumerate(zip(old_rows, rows)):
+            if old != new:
+                self.dataChanged.emit(
+                    self.index(rowIndex, 0), self.index(rowIndex, len(self.COLUMNS) - 1)
+                )
+
+    def patchRows(self, values):
+        """
+        原地修改部分行的字段
+
+        Args:
+            values (dict): {id: {字段: 值}}
+        """
+        for rowIndex, row in enumerate(self.rows):
+            if row["id"] in values:
+                row.update(values[row["id"]])
+                self.dataChanged.emit(
+                    self.index(rowIndex, 0), self.index(rowIndex, len(self.COLUMNS) - 1)
+                )
+
+
+class ButtonDelegate(QStyledItemDelegate):
+    """
+    在单元格内绘制按钮, 不为每行创建真实的QPushButton
+    """
+
+    clicked = pyqtSignal(QModelIndex)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pressedIndex = QModelIndex()
+
+    def buttonOption(self, option, index):
+        button = QStyleOptionButton()
+        button.rect = option.rect.adjusted(2, 2, -2, -2)
+        button.text = index.data(Qt.DisplayRole)
+        button.state = QStyle.State_Enabled
+        if index == self.pressedIndex:
+            button.state |= QStyle.State_Sunken
+        else:
+            button.state |= QStyle.State_Raised
+        if index.column() == 2:
+            button.features = QStyleOptionButton.HasMenu
+        return button
+
+    def paint(self, painter, option, index):
+        if not index.data(Qt.DisplayRole):
+            super().paint(painter, option, index)
+            return
+        widget = option.widget
+        style = widget.style() if widget else QApplication.style()
+        style.drawControl(QStyle.CE_PushButton, self.buttonOption(option, index), painter, widget)
+
+    def editorEvent(self, event, model, option, index):
+        if not index.data(Qt.DisplayRole):
+            return False
+        if event.type() == QEvent.MouseButtonPress and event.button() == Qt.LeftButton:
+            self.pressedIndex = index
+            return True
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            pressed, self.pressedIndex = self.pressedIndex, QModelIndex()
+            if pressed == index and option.rect.contains(event.pos()):
+                self.clicked.emit(index)
+            return True
+        return False
+
+
 class FlingTrainerApp(QWidget):
+    catalogChanged = pyqtSignal(dict)
+    searchFinished = pyqtSignal(int, list, float)
+    logRequested = pyqtSignal(str)
+    updatesChecked = pyqtSignal(dict)
+    # 界面线程发起的写操作提交后通知, 参数为应用id
+    appUpdated = pyqtSignal(int)
+
     def __init__(self):
         super().__init__()
         self.home_dir = ""
@@ -130,9 +620,14 @@ class FlingTrainerApp(QWidget):
         self.debugMode = False
         self.initHome()
         self.loadSettings()
+        self.initHttp()
         self.initDB()
         self.checkAndInitializeDB()
         self.initUI()
+        self.catalogChanged.connect(self.onCatalogChanged)
+        self.appUpdated.connect(lambda id: self.searchData())
+        self.initDownloadQueue()
+        self.initScheduler()
         self.show()  # 先显示主窗口
         self.searchData()
         self.logMessage("初始化中...")
@@ -150,6 +645,7 @@ class FlingTrainerApp(QWidget):
         self.home_dir = app_home
         self.db_path = f"sqlite:///{os.path.join(app_home,'flingtrainer_app.db')}"
         self.config_path = os.path.join(app_home, "config.json")
+        self.pageCache = PageCache(os.path.join(app_home, "cache"))
         if not os.path.exists(self.config_path):
             with open(self.config_path, "w", encoding="utf-8") as cfp:
                 default_download_path = os.path.join(user_home, "flingtrainer_app")
@@ -169,6 +665,37 @@ class FlingTrainerApp(QWidget):
             self.settings = {"download_path": "", "debug_mode": False}
         self.downloadPath = self.settings.get("download_path", "")
         self.debugMode = self.settings.get("debug_mode", False)
+        self.prefetchWorkers = self.settings.get("prefetch_workers", PREFETCH_WORKERS)
+        self.prefetchMinutes = self.settings.get("prefetch_minutes", PREFETCH_MINUTES)
+        self.downloadSegments = self.settings.get("download_segments", DOWNLOAD_SEGMENTS)
+        self.downloadConcurrency = self.settings.get(
+            "download_concurrency", DOWNLOAD_CONCURRENCY
+        )
+        self.downloadPerHost = self.settings.get("download_per_host", DOWNLOAD_PER_HOST)
+        self.catalogRefreshMinutes = self.settings.get(
+            "catalog_refresh_minutes", CATALOG_REFRESH_MINUTES
+        )
+        self.updateCheckMinutes = self.settings.get(
+            "update_check_minutes", UPDATE_CHECK_MINUTES
+        )
+        # 后台检查到更新时是否自动下载, 否则只在列表中标记
+        self.autoUpdate = self.settings.get("auto_update", False)
+        self.extractRules = None
+        if self.settings.get("selective_extract", True):
+            self.extractRules = ExtractRules(
+                **self.settings.get("extract_rules", EXTRACT_RULES)
+            )
+
+    def initHttp(self) -> NoReturn:
+        """
+        初始化共享的HTTP客户端, 并在构建界面期间预先建立连接
+        """
+        self.http = HttpClient(
+            timeout=tuple(self.settings.get("http_timeout", HTTP_TIMEOUT)),
+            retries=self.settings.get("http_retries", HTTP_RETRIES),
+            pool_size=max(HTTP_POOL_SIZE, self.prefetchWorkers, self.downloadSegments),
+        )
+        self.http.prewarm([TRAINER_LIST_URL])
 
     def saveSettings(self) -> NoReturn:
         """
@@ -194,11 +721,22 @@ class FlingTrainerApp(QWidget):
         topLayout = QHBoxLayout()
         self.searchBar = QLineEdit(self)
         self.searchBar.setPlaceholderText("搜索...")
-        self.searchBar.textChanged.connect(self.searchData)
+        self.searchBar.textChanged.connect(self.onSearchTextChanged)
         topLayout.addWidget(self.searchBar)
 
         self.downloadedCheckBox = QCheckBox("已下载", self)
         self.downloadedCheckBox.stateChanged.connect(self.searchData)
+
+        # 输入停顿后再搜索
+        self.searchTimer = QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.searchTimer.timeout.connect(self.searchData)
+        self.searchGeneration = 0
+        self.searchFuture = None
+        self.searchTypedAt = None
+        self.searchExecutor = ThreadPoolExecutor(max_workers=1)
+        self.searchFinished.connect(self.onSearchFinished)
         topLayout.addWidget(self.downloadedCheckBox)
 
         if self.debugMode:
@@ -206,6 +744,10 @@ class FlingTrainerApp(QWidget):
             refreshButton.clicked.connect(self.updateDB)
             topLayout.addWidget(refreshButton)
 
+        checkUpdatesButton = QPushButton("检查更新", self)
+        checkUpdatesButton.clicked.connect(self.checkAllUpdates)
+        topLayout.addWidget(checkUpdatesButton)
+
         settingsButton = QPushButton("设置", self)
         settingsButton.clicked.connect(self.openSettings)
         topLayout.addWidget(settingsButton)
@@ -213,32 +755,53 @@ class FlingTrainerApp(QWidget):
         layout.addLayout(topLayout)
 
         # Table to display data
-        self.tableWidget = QTableWidget(self)
-        self.setTableWidget()
-        layout.addWidget(self.tableWidget)
+        self.tableModel = FlingTrainerTableModel(self)
+        self.tableView = QTableView(self)
+        self.tableView.setModel(self.tableModel)
+        self.buttonDelegate = ButtonDelegate(self.tableView)
+        self.buttonDelegate.clicked.connect(self.onTableButtonClicked)
+        for column in (1, 2, 3):
+            self.tableView.setItemDelegateForColumn(column, self.buttonDelegate)
+        self.setTableView()
+        layout.addWidget(self.tableView)
+        # 下载队列
+        self.jobList = QTreeWidget(self)
+        self.jobList.setHeaderLabels(["名称", "状态", "进度"])
+        self.jobList.setRootIsDecorated(False)
+        self.jobList.setColumnWidth(0, 260)
+        self.jobList.setColumnWidth(1, 60)
+        self.jobList.setFixedHeight(90)
+        self.jobList.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.jobList.customContextMenuRequested.connect(self.showJobMenu)
+        self.jobList.setVisible(False)
+        self.jobItems = {}
+        layout.addWidget(self.jobList)
         # Log text box
         self.logTextBox = QTextEdit(self)
         self.logTextBox.setReadOnly(True)
         self.logTextBox.setFixedHeight(100)
+        self.logRequested.connect(self.appendLog)
         layout.addWidget(self.logTextBox)
 
         self.setLayout(layout)
 
-    def setTableWidget(self):
+    def setTableView(self):
         """
         设置列表区域
         """
-        self.tableWidget.setColumnCount(4)
-        self.tableWidget.setHorizontalHeaderLabels(["名称", "提示", "管理", "操作"])
-        self.tableWidget.horizontalHeader().setVisible(False)
-        self.tableWidget.verticalHeader().setVisible(False)
-        self.tableWidget.setEditTriggers(QTableWidget.NoEditTriggers)
-        self.tableWidget.setColumnWidth(0, 358)
-        self.tableWidget.setColumnWidth(1, 60)
-        self.tableWidget.setColumnWidth(2, 60)
-        self.tableWidget.setColumnWidth(3, 60)
-        self.tableWidget.setShowGrid(False)  # 隐藏所有网格线
-        self.tableWidget.setStyleSheet(
+        self.tableView.horizontalHeader().setVisible(False)
+        self.tableView.verticalHeader().setVisible(False)
+        # 固定行高, 滚动时无需逐行计算尺寸
+        self.tableView.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.tableView.verticalHeader().setDefaultSectionSize(30)
+        self.tableView.setEditTriggers(QTableView.NoEditTriggers)
+        self.tableView.setSelectionMode(QTableView.NoSelection)
+        self.tableView.setColumnWidth(0, 358)
+        self.tableView.setColumnWidth(1, 60)
+        self.tableView.setColumnWidth(2, 60)
+        self.tableView.setColumnWidth(3, 60)
+        self.tableView.setShowGrid(False)  # 隐藏所有网格线
+        self.tableView.setStyleSheet(
             "QTableView::item { border-bottom: 1px solid #dcdcdc; }"
         )
 
@@ -250,7 +813,10 @@ class FlingTrainerApp(QWidget):
             message ():
         """
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] {message}\n"
+        # 后台线程不能直接操作控件, 通过信号转到界面线程
+        self.logRequested.emit(f"[{timestamp}] {message}\n")
+
+    def appendLog(self, log_entry):
         self.logTextBox.insertPlainText(log_entry)
         self.logTextBox.moveCursor(QTextCursor.End)
         self.logTextBox.ensureCursorVisible()
@@ -259,24 +825,72 @@ class FlingTrainerApp(QWidget):
         """
         初始化数据库
         """
-        self.engine = create_engine(self.db_path)
+        self.engine = create_db_engine(
+            self.db_path,
+            pool_size=DB_POOL_SIZE,
+            cache_mb=DB_CACHE_MB,
+            mmap_mb=DB_MMAP_MB,
+            busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+        )
         self.Session = sessionmaker(bind=self.engine)
+        # 所有写操作都交给同一个写线程, 读操作直接使用Session
+        self.dbWriter = DBWriter(self.Session, DB_WRITE_BATCH)
+        self.appInfoCache = AppInfoCache(
+            self.Session, APP_INFO_MAX_AGE, APP_INFO_CACHE_SIZE, self.dbWriter
+        )
+        self.readmeDecoder = ReadmeDecoder(self.Session, writer=self.dbWriter)
+        self.archiveStore = ArchiveStore(
+            self.Session,
+            os.path.join(self.home_dir, "archives"),
+            self.settings.get("archive_cache_mb", ARCHIVE_CACHE_MB) * 1024 * 1024,
+            self.dbWriter,
+        )
+
+    def updateApp(self, id, readme=None, wait=True, **values):
+        """
+        通过写线程修改应用记录, readme不为None时一并保存说明文本;
+        界面线程中使用wait=False, 不等待提交, 提交后发出appUpdated
+        """
+
+        def write(session):
+            session.execute(
+                update(FlingTrainerAppModel)
+                .where(FlingTrainerAppModel.id == id)
+                .values(**values)
+            )
+            if readme is not None:
+                save_readme(session, id, readme)
+
+        if wait:
+            self.dbWriter.run(write)
+            return
+
+        def done(future):
+            # 在写线程中调用, 信号排队到界面线程
+            if future.exception() is None:
+                self.appUpdated.emit(id)
+
+        self.dbWriter.submit(write).add_done_callback(done)
 
     def checkAndInitializeDB(self):
         Base.metadata.create_all(self.engine)
+        upgrade_schema(self.engine)
+        migrate_readmes(self.engine)
+        backfill_derived_columns(self.engine)
+        self.ftsEnabled = init_search_index(self.engine)
 
     def createManageMenu(self, id):
         menu = QMenu()
 
-        viewAction = QAction("查看", self)
+        viewAction = QAction("查看", menu)
         viewAction.triggered.connect(lambda: self.openFileDir(id))
         menu.addAction(viewAction)
 
-        updateAction = QAction("更新", self)
+        updateAction = QAction("更新", menu)
         updateAction.triggered.connect(lambda: self.updateFile(id))
         menu.addAction(updateAction)
 
-        uninstallAction = QAction("卸载", self)
+        uninstallAction = QAction("卸载", menu)
         uninstallAction.triggered.connect(lambda: self.confirmUninstall(id))
         menu.addAction(uninstallAction)
 
@@ -303,28 +917,34 @@ class FlingTrainerApp(QWidget):
         session.close()
 
     def uninstallFile(self, id):
-        session = self.Session()
-        app = session.query(FlingTrainerAppModel).filter_by(id=id).first()
+        app = self.getAppById(id)
         if app:
             if os.path.exists(app.save_path):
                 # 删除文件夹
-                shutil.rmtree(os.path.dirname(app.save_path), ignore_errors=True)
-            app.download = False
-            app.save_path = ""
-            app.app_md5 = ""
-            session.commit()
+                save_dir = self.installDir(app.save_path)
+                Installer(os.path.dirname(save_dir)).retire(save_dir)
+            self.updateApp(id, wait=False, download=False, save_path="", app_md5="")
             self.logMessage(f"{app.name_zh if app.name_zh else app.name_en}已卸载")
-        session.close()
+            return
         self.searchData()
 
+    @staticmethod
+    def installDir(save_path):
+        """
+        应用的安装目录, 没有找到修改器时save_path就是安装目录
+        """
+        if not save_path:
+            return None
+        return save_path if os.path.isdir(save_path) else os.path.dirname(save_path)
+
     def viewWarn(self, id):
         session = self.Session()
-        app = session.query(FlingTrainerAppModel).filter_by(id=id).first()
+        readme = load_readme(session, id)
 
         reply = QMessageBox.question(
             self,
             "提示",
-            f"该应用包含以下注意事项，是否打开目录查看！！！\n{app.readme}",
+            f"该应用包含以下注意事项，是否打开目录查看！！！\n{readme}",
             QMessageBox.Yes | QMessageBox.No,
             QMessageBox.No,
         )
@@ -338,22 +958,28 @@ class FlingTrainerApp(QWidget):
         return name_zh
 
     def getlist(self):
-        url = "https://flingtrainer.com/all-trainers-a-z/"
-        payload = {}
+        url = TRAINER_LIST_URL
         headers = {
             "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
             "accept-language": "zh-CN,zh;q=0.9",
             "priority": "u=0, i",
-            "referer": "https://flingtrainer.com/all-trainers-a-z/",
+            "referer": TRAINER_LIST_URL,
             "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36",
         }
+        session = self.Session()
+        empty = session.query(FlingTrainerAppModel.id).first() is None
+        session.close()
+        if empty:
+            # 数据库是新建的(或被删除重建)而页面缓存还在时, 不能因为列表未变化就跳过同步
+            self.pageCache.invalidate(url)
         t1 = time.time()
-        response = requests.request("GET", url, headers=headers, data=payload)
+        page = self.pageCache.fetch(url, headers=headers, http=self.http)
         t2 = time.time()
-        self.logMessage(
-            f"请求列表{'成功' if response.status_code== 200 else '失败'}耗时{int(t2-t1)}秒"
-        )
-        html = response.text
+        self.logMessage(f"请求列表成功耗时{int(t2-t1)}秒")
+        if not page["changed"]:
+            self.print(f"列表未变化({page['status']}),跳过解析")
+            return None
+        html = page["text"]
         root = etree.HTML(html)
         game_list = root.xpath("..//div[starts-with(@id,'a-z-listing-letter')]/ul/li/a")
 
@@ -403,100 +1029,343 @@ class FlingTrainerApp(QWidget):
         return game_app
 
     def updateDB(self):
+        """
+        Returns:
+            bool: 上次更新还没结束时返回False
+        """
+        if getattr(self, "updateDBWorker", None) and self.updateDBWorker.isRunning():
+            return False
         self.logMessage("数据库更新中...")
-        self.worker = Worker(self.asyncUpdateDB)
-        self.worker.finished.connect(self.onUpdateDBFinished)
-        self.worker.start()
+        self.updateDBWorker = Worker(self.asyncUpdateDB)
+        self.updateDBWorker.finished.connect(self.onUpdateDBFinished)
+        self.updateDBWorker.start()
+        return True
 
     def onUpdateDBFinished(self):
+        ok = self.updateDBWorker.result is not False
+        self.scheduler.done("catalog", ok)
+        if not ok:
+            return
         self.logMessage("数据库更新完成")
-        self.searchData()
+        self.prefetchAppInfo()
 
-    def asyncUpdateDB(self):
-        app_list = self.getlist()
+    def prefetchAppInfo(self):
+        """
+        后台预取已下载/热门/新增应用的详情页, 刷新列表后和按prefetchMinutes定期运行
+
+        Returns:
+            bool: 上次预取还没结束时返回False
+        """
+        if getattr(self, "prefetchWorker", None) and self.prefetchWorker.isRunning():
+            return False
+        self.prefetchWorker = Worker(self.asyncPrefetchAppInfo)
+        self.prefetchWorker.finished.connect(lambda: self.scheduler.done("prefetch"))
+        self.prefetchWorker.start()
+        return True
+
+    def asyncPrefetchAppInfo(self):
         session = self.Session()
-        for name_en, app_data in app_list.items():
-            page_url = app_data.get("page_url")
-            is_hot = app_data.get("hot", False)
-            is_new = app_data.get("new", False)
-            app = session.query(FlingTrainerAppModel).filter_by(name_en=name_en).first()
-            if app:
-                app.page_url = page_url
-                app.is_hot = is_hot
-                app.is_new = is_new
-            else:
-                # name_en = name_en.strip().strip("Trainer").strip()
-                name_zh = GAME_NAME_MAP.get(name_en, name_en)
-                app = FlingTrainerAppModel(
-                    name_en=name_en,
-                    name_zh=name_zh,
-                    page_url=page_url,
-                    is_hot=is_hot,
-                    is_new=is_new,
-                )
-                session.add(app)
-            session.commit()
+        apps = (
+            session.query(FlingTrainerAppModel.page_url, FlingTrainerAppModel.app_md5)
+            .filter(
+                (FlingTrainerAppModel.download == True)
+                | (FlingTrainerAppModel.is_hot == True)
+                | (FlingTrainerAppModel.is_new == True)
+            )
+            .filter(FlingTrainerAppModel.is_removed.isnot(True))
+            .all()
+        )
         session.close()
+        installed = {page_url: app_md5 for page_url, app_md5 in apps if app_md5}
+        # 下次定期预取(含抖动)之前就会过期的也重新请求, 点击时总能命中缓存
+        margin = max(self.prefetchMinutes, 0) * 60 * 1.1
+        page_urls = self.appInfoCache.missing((page_url for page_url, _ in apps), margin)
+        if not page_urls:
+            return
+        t1 = time.time()
+        app_infos = {}
+        updatable = 0
+        with ThreadPoolExecutor(max_workers=max(1, self.prefetchWorkers)) as pool:
+            futures = {
+                pool.submit(self.parse_app_info, page_url): page_url
+                for page_url in page_urls
+            }
+            for future in as_completed(futures):
+                page_url = futures[future]
+                try:
+                    app_info = future.result()
+                except Exception as err:
+                    self.print(f"预取{page_url}失败: {err}")
+                    continue
+                app_infos[page_url] = app_info
+                md5 = installed.get(page_url)
+                if md5 and md5 != app_info.get("md5"):
+                    updatable += 1
+        self.appInfoCache.put_many(app_infos)
+        t2 = time.time()
+        self.print(f"预取详情页{len(app_infos)}/{len(page_urls)}个 耗时{t2-t1:.1f}秒")
+        if updatable:
+            self.logMessage(f"{updatable}个已下载的应用有更新")
 
-    def searchData(self):
-        searchText = self.searchBar.text()
-        downloaded = self.downloadedCheckBox.isChecked()
+    def checkAllUpdates(self, background=False):
+        """
+        并发检查所有已下载应用的更新, 有变化的加入下载队列;
+        后台检查且未开启自动更新时只在列表中标记
 
-        session = self.Session()
-        query = (
-            session.query(FlingTrainerAppModel)
-            .filter(
-                (FlingTrainerAppModel.name_zh.like(f"%{searchText}%"))
-                | (FlingTrainerAppModel.name_en.like(f"%{searchText}%"))
+        Returns:
+            bool: 上次检查还没结束时返回False
+        """
+        if getattr(self, "checkUpdatesWorker", None) and self.checkUpdatesWorker.isRunning():
+            if not background:
+                self.logMessage("正在检查更新...")
+            return False
+        if not background:
+            self.logMessage("检查更新中...")
+        self.checkUpdatesWorker = Worker(self.asyncCheckAllUpdates, background)
+        self.checkUpdatesWorker.finished.connect(
+            lambda: self.scheduler.done(
+                "updates", self.checkUpdatesWorker.result is not False
             )
-            .order_by(
-                FlingTrainerAppModel.download.desc(),
-                FlingTrainerAppModel.is_hot.desc(),
-                FlingTrainerAppModel.is_new.desc(),
+        )
+        self.checkUpdatesWorker.start()
+        return True
+
+    def asyncCheckAllUpdates(self, background=False):
+        """
+        Returns:
+            bool: 全部检查失败(如网络不通)时返回False
+        """
+        session = self.Session()
+        apps = (
+            session.query(
+                FlingTrainerAppModel.id,
                 FlingTrainerAppModel.name_zh,
                 FlingTrainerAppModel.name_en,
+                FlingTrainerAppModel.page_url,
+                FlingTrainerAppModel.app_md5,
+                FlingTrainerAppModel.update_date,
             )
+            .filter(FlingTrainerAppModel.download == True)
+            .filter(FlingTrainerAppModel.is_removed.isnot(True))
+            .all()
         )
-        if downloaded:
-            query = query.filter(FlingTrainerAppModel.download == True)
-        results = query.all()
         session.close()
-        self.updateTable(results)
-
-    def updateTable(self, data):
-        self.setTableWidget()
-        self.tableWidget.setRowCount(len(data))
-        for rowIndex, rowData in enumerate(data):
-            name = f"{'🔥' if rowData.is_hot else ''}{'🆕' if rowData.is_new else ''}{rowData.name_zh+'('+rowData.name_en+')' if rowData.name_zh else rowData.name_en}"
-            nameItem = QTableWidgetItem(name)
-            nameItem.setFlags(Qt.ItemIsEnabled)
-            nameItem.setData(Qt.UserRole, rowData.page_url)
-            self.tableWidget.setItem(rowIndex, 0, nameItem)
-
-            # 清除旧的按钮
-            self.tableWidget.setCellWidget(rowIndex, 1, None)  # 清除按钮
-            self.tableWidget.setCellWidget(rowIndex, 2, None)  # 清除管理按钮
-            self.tableWidget.setCellWidget(rowIndex, 3, None)  # 清除打开/下载按钮
-            if rowData.download:
-                # 创建管理按钮
-                if rowData.readme:
-                    warnButton = QPushButton("点我!")
-                    warnButton.clicked.connect(
-                        lambda _, id=rowData.id: self.viewWarn(id)
-                    )  # 设置菜单
-                    self.tableWidget.setCellWidget(rowIndex, 1, warnButton)
-                manageButton = QPushButton("管理")
-                manageButton.setMenu(self.createManageMenu(rowData.id))  # 设置菜单
-                self.tableWidget.setCellWidget(rowIndex, 2, manageButton)
-                openButton = QPushButton("打开")
-                openButton.clicked.connect(lambda _, id=rowData.id: self.openFile(id))
-                self.tableWidget.setCellWidget(rowIndex, 3, openButton)
-            else:
-                downloadButton = QPushButton("下载")
-                downloadButton.clicked.connect(
-                    lambda _, id=rowData.id: self.downloadFile(id)
+        t1 = time.time()
+        report = {
+            "checked": len(apps),
+            "changed": [],
+            "latest": 0,
+            "failed": [],
+            "background": background,
+        }
+        app_infos = {}
+
+        def probe(app):
+            # 不使用缓存, 重新请求详情页
+            app_info = self.parse_app_info(app.page_url)
+            return app_info, self.needsUpdate(app.app_md5, app.update_date, app_info)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.prefetchWorkers)) as pool:
+            futures = {pool.submit(probe, app): app for app in apps}
+            for future in as_completed(futures):
+                app = futures[future]
+                name = app.name_zh or app.name_en
+                try:
+                    app_info, changed = future.result()
+                except Exception as err:
+                    self.print(f"检查{name}失败: {err}")
+                    report["failed"].append(name)
+                    continue
+                app_infos[app.page_url] = app_info
+                if changed:
+                    report["changed"].append((app.id, name))
+                else:
+                    report["latest"] += 1
+        # 随后的更新任务直接使用这次请求的结果
+        self.appInfoCache.put_many(app_infos)
+        report["elapsed"] = time.time() - t1
+        self.updatesChecked.emit(report)
+        return bool(app_infos) or not report["failed"]
+
+    def needsUpdate(self, app_md5, update_date, app_info):
+        """
+        标题、日期或服务器上文件的校验值有变化时需要更新
+        """
+        if app_md5 != app_info.get("md5"):
+            return True
+        if update_date and update_date != app_info.get("date"):
+            return True
+        return self.archiveChanged(app_info.get("url"))
+
+    def onUpdatesChecked(self, report):
+        summary = (
+            f"检查{report['checked']}个已下载的应用 耗时{report['elapsed']:.1f}秒: "
+            f"有更新{len(report['changed'])}个 已是最新{report['latest']}个 "
+            f"检查失败{len(report['failed'])}个"
+        )
+        if report["background"]:
+            # 后台检查没有发现更新时不打扰
+            self.print(summary)
+        else:
+            self.logMessage(summary)
+            if report["failed"]:
+                self.logMessage(f"检查失败: {'、'.join(report['failed'])}")
+        if report["background"] and not self.autoUpdate:
+            if report["changed"]:
+                self.updatesAvailable.update(id for id, _ in report["changed"])
+                self.tableModel.patchRows(
+                    {id: {"has_update": True} for id, _ in report["changed"]}
+                )
+                self.logMessage(
+                    f"{'、'.join(name for _, name in report['changed'])}有更新, 可在管理中更新"
                 )
-                self.tableWidget.setCellWidget(rowIndex, 3, downloadButton)
+            return
+        for id, name in report["changed"]:
+            jobId = self.enqueueJob(id, "update", DownloadQueue.PRIORITY_BACKGROUND)
+            if jobId is not None:
+                self.updateBatch[jobId] = name
+        if report["changed"]:
+            self.logMessage(f"开始更新: {'、'.join(name for _, name in report['changed'])}")
+
+    def getAppInfo(self, page_url):
+        """
+        优先使用缓存的详情页信息, 没有或已过期时重新请求
+        """
+        app_info = self.appInfoCache.get(page_url)
+        if app_info is None:
+            app_info = self.parse_app_info(page_url)
+            self.appInfoCache.put(page_url, app_info)
+        stats = self.appInfoCache.stats()
+        self.print(f"详情页缓存 命中{stats['hits']} 未命中{stats['misses']}")
+        return app_info
+
+    def onCatalogChanged(self, changes):
+        """
+        根据目录变更集刷新列表, 只有链接变化时原地修改受影响的行
+        """
+        self.print({k: len(v) for k, v in changes.items()})
+        if not any(changes.values()):
+            return
+        relist_keys = ("added", "removed", "restored", "hot_changed", "new_changed")
+        if any(changes[k] for k in relist_keys):
+            self.searchData()
+            return
+        ids = set(changes["url_changed"])
+        session = self.Session()
+        urls = dict(
+            session.query(FlingTrainerAppModel.id, FlingTrainerAppModel.page_url)
+            .filter(FlingTrainerAppModel.id.in_(ids))
+            .all()
+        )
+        session.close()
+        self.tableModel.patchRows(
+            {id: {"page_url": page_url} for id, page_url in urls.items()}
+        )
+
+    def asyncUpdateDB(self):
+        try:
+            app_list = self.getlist()
+        except Exception as err:
+            self.print(err)
+            self.logMessage("请求列表失败")
+            return False
+        if app_list is None:
+            return True
+        try:
+            t1 = time.time()
+            result = self.dbWriter.run(sync_apps, app_list, GAME_NAME_MAP)
+            t2 = time.time()
+            self.print(
+                f"同步完成: 新增{result['inserted']} 更新{result['updated']} "
+                f"未变化{result['unchanged']} 下架{result['removed']} 耗时{t2-t1:.3f}秒"
+            )
+            self.catalogChanged.emit(result["changes"])
+            self.pageCache.commit(TRAINER_LIST_URL)
+            return True
+        except Exception as err:
+            self.print(err)
+            self.logMessage("更新数据库失败")
+            return False
+
+    def onSearchTextChanged(self):
+        if self.searchTypedAt is None:
+            self.searchTypedAt = time.perf_counter()
+        self.searchTimer.start()
+
+    def searchData(self):
+        """
+        在后台线程执行搜索, 新的搜索会使尚未完成的旧搜索作废
+        """
+        self.searchTimer.stop()
+        searchText = self.searchBar.text()
+        downloaded = self.downloadedCheckBox.isChecked()
+        self.searchGeneration += 1
+        if self.searchFuture is not None:
+            self.searchFuture.cancel()
+        self.searchFuture = self.searchExecutor.submit(
+            self.asyncSearchData, self.searchGeneration, searchText, downloaded
+        )
+
+    def asyncSearchData(self, generation, searchText, downloaded):
+        if generation != self.searchGeneration:
+            return
+        t1 = time.perf_counter()
+        session = self.Session()
+        try:
+            query = search_apps(session, searchText, downloaded, self.ftsEnabled)
+            rows = self.toTableRows(query.all())
+        except Exception as err:
+            self.print(err)
+            return
+        finally:
+            session.close()
+        self.searchFinished.emit(generation, rows, time.perf_counter() - t1)
+
+    def onSearchFinished(self, generation, rows, queryTime):
+        if generation != self.searchGeneration:
+            return
+        self.updateTable(rows)
+        if self.searchTypedAt is not None:
+            typedAt, self.searchTypedAt = self.searchTypedAt, None
+            if self.debugMode:
+                self.print(
+                    f"搜索[{self.searchBar.text()}] {len(rows)}条 查询{queryTime*1000:.1f}ms "
+                    f"输入到显示{(time.perf_counter()-typedAt)*1000:.1f}ms"
+                )
+
+    def toTableRows(self, data):
+        return [
+            {
+                "id": rowData.id,
+                "name_zh": rowData.name_zh,
+                "name_en": rowData.name_en,
+                "page_url": rowData.page_url,
+                "download": bool(rowData.download),
+                "has_readme": bool(rowData.has_readme),
+                "is_hot": bool(rowData.is_hot),
+                "is_new": bool(rowData.is_new),
+                "is_removed": bool(rowData.is_removed),
+                "has_update": rowData.id in self.updatesAvailable,
+            }
+            for rowData in data
+        ]
+
+    def updateTable(self, rows):
+        self.tableModel.setRows(rows)
+
+    def onTableButtonClicked(self, index):
+        row = self.tableModel.rows[index.row()]
+        if index.column() == 1:
+            self.viewWarn(row["id"])
+        elif index.column() == 2:
+            menu = self.createManageMenu(row["id"])
+            rect = self.tableView.visualRect(index)
+            menu.exec_(self.tableView.viewport().mapToGlobal(rect.bottomLeft()))
+        elif index.column() == 3:
+            if row["download"]:
+                self.openFile(row["id"])
+            else:
+                self.downloadFile(row["id"])
 
     def openFile(self, id):
         try:
@@ -506,13 +1375,11 @@ class FlingTrainerApp(QWidget):
                 f"打开{app.name_zh if app.name_zh else app.name_en}风灵月影工具"
             )
             if not os.path.exists(app.save_path):
-                app.download = False
-                session.commit()
                 session.close()
+                self.updateApp(id, wait=False, download=False)
                 self.logMessage(
                     f"{app.name_zh if app.name_zh else app.name_en}风灵月影已丢失请重新下载!"
                 )
-                self.searchData()
                 return
             isdir = os.path.isdir(app.save_path)
             # 打开文件逻辑
@@ -563,12 +1430,12 @@ class FlingTrainerApp(QWidget):
         return app
 
     def parse_app_info(self, page_url):
-        payload = {}
         headers = {
             "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
             "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36",
         }
-        response = requests.request("GET", page_url, headers=headers, data=payload)
+        response = self.http.get(page_url, headers=headers)
+        response.raise_for_status()
         html = response.text
         root = etree.HTML(html)
         attachment = root.xpath("..//tr[@class='rar' or @class='zip']")[0]
@@ -590,41 +1457,123 @@ class FlingTrainerApp(QWidget):
         print(f"app_info:{app_info}")
         return app_info
 
-    def save_file(self, app_info, save_dir):
+    def save_file(self, app_info, save_dir, progress=None, cancel=None):
+        sha256, unpacked = self.fetch_archive(
+            app_info, save_dir, progress=progress, cancel=cancel
+        )
+        try:
+            return self.install_archive(app_info, sha256, save_dir, unpacked)
+        finally:
+            self.archiveStore.release(sha256)
+
+    def fetch_archive(self, app_info, save_dir, progress=None, cancel=None):
+        """
+        获取压缩包放入缓存, 服务器上的文件和上次下载的一致时不再下载;
+        zip单连接下载时边下载边解压到临时目录.
+        返回的压缩包已在缓存中hold, 安装完成后由调用方release
+
+        Returns:
+            tuple: (压缩包内容的sha256, 已解压的临时目录, 未边下载边解压时为None)
+        """
         title = app_info.get("title")
         url = app_info.get("url")
         md5 = app_info.get("md5")
         file_type = app_info.get("file_type")
-        temp_path = os.path.join(save_dir, "temp", md5, f"{int(time.time())}/")
+        unpacked = os.path.join(save_dir, "temp", md5 + Installer.STAGING_SUFFIX)
+        sink = None
+        if file_type == "zip":
+            sink = ZipStreamExtractor(unpacked, rules=self.extractRules)
+        downloader = FileDownloader(
+            self.http,
+            progress=progress,
+            segments=self.downloadSegments,
+            segment_threshold=DOWNLOAD_SEGMENT_THRESHOLD,
+            cancel=cancel,
+            sink=sink,
+        )
+        remote = downloader.remote_version(url)
+        if remote:
+            sha256 = self.archiveStore.lookup(url, *remote)
+            if sha256:
+                self.print(f"使用缓存的压缩包 sha256:{sha256}")
+                app_info["sha256"] = sha256
+                return sha256, None
+        # 固定的临时目录, 中断后下次下载可以续传
+        temp_path = os.path.join(save_dir, "temp", md5)
         if not os.path.exists(temp_path):
             os.makedirs(temp_path)
             os.chmod(temp_path, 0o777)
         temp_file_path = os.path.join(temp_path, f"{title}.{file_type}")
-        local_file, header = urlretrieve(url, filename=temp_file_path)
-        save_path = os.path.join(save_dir, md5)
-        if file_type == "zip":
-            shutil.unpack_archive(temp_file_path, save_path)
-        elif file_type == "rar":
-            if not os.path.exists(save_path):
-                os.makedirs(save_path)
-                os.chmod(save_path, 0o777)
-            if hasattr(sys, "_MEIPASS"):
-                current_dir = sys._MEIPASS
-            else:
-                current_dir = os.path.dirname(os.path.abspath(__file__))
-            # 构建 unrar 可执行文件的路径
-            unrar_path = os.path.join(current_dir, "bin", "UnRAR.exe")
-            print(unrar_path)
-            # 构建解压命令
-            command = [unrar_path, "x", "-y", temp_file_path, save_path]
-            try:
-                # 调用 unrar 命令
-                subprocess.run(command, check=True)
-            except subprocess.CalledProcessError as e:
-                print(f"解压失败: {e}")
+        try:
+            result = downloader.download(url, temp_file_path)
+        except DownloadCancelled as err:
+            if err.reason == "cancel":
+                shutil.rmtree(temp_path, ignore_errors=True)
+            if sink:
+                shutil.rmtree(unpacked, ignore_errors=True)
+            raise
+        if not (result["streamed"] and sink.finish(temp_file_path)):
+            if sink and sink.failed:
+                self.print(f"边下载边解压失败, 下载完成后重新解压: {sink.failed}")
+            shutil.rmtree(unpacked, ignore_errors=True)
+            unpacked = None
+        self.print(
+            f"下载{result['size']}字节(从{result['resumed']}续传, {result['segments']}段) "
+            f"耗时{result['elapsed']:.1f}秒 "
+            f"sha256:{result['sha256']}"
+        )
+        self.archiveStore.add(
+            temp_file_path,
+            result["sha256"],
+            url,
+            etag=result["etag"],
+            last_modified=result["last_modified"],
+        )
         os.chmod(temp_path, stat.S_IWRITE)
         shutil.rmtree(temp_path, ignore_errors=True)
-        # print(os.stat(temp_path))
+        app_info["sha256"] = result["sha256"]
+        return result["sha256"], unpacked
+
+    @staticmethod
+    def unrarTool():
+        """
+        Windows下使用打包的UnRAR.exe, 其他系统由rarfile在PATH中查找
+        """
+        if platform.system() != "Windows":
+            return None
+        if hasattr(sys, "_MEIPASS"):
+            current_dir = sys._MEIPASS
+        else:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+        unrar_path = os.path.join(current_dir, "bin", "UnRAR.exe")
+        return unrar_path if os.path.exists(unrar_path) else None
+
+    def install_archive(self, app_info, sha256, save_dir, unpacked=None, live=None):
+        """
+        在临时目录中解压(或使用边下载边解压的临时目录), 完成后一次重命名放到安装位置
+
+        Args:
+            live (str): 正在使用的安装目录, 新版本不会覆盖它
+
+        Returns:
+            tuple: (修改器路径, readme路径)
+        """
+        md5 = app_info.get("md5")
+        file_type = app_info.get("file_type")
+        installer = Installer(save_dir)
+        if not unpacked:
+            # 压缩包由fetch_archive hold, 解压期间不会被淘汰
+            unpacked = installer.staging(md5)
+            ArchiveExtractor(unrar_tool=self.unrarTool()).extract(
+                self.archiveStore.path(sha256),
+                unpacked,
+                file_type,
+                rules=self.extractRules,
+            )
+        os.chmod(unpacked, 0o777)
+        save_path = installer.activate(
+            unpacked, installer.target(md5, live=live, suffix=sha256[:12])
+        )
         files = os.listdir(save_path)
         trainer = save_path
         readme = ""
@@ -637,91 +1586,484 @@ class FlingTrainerApp(QWidget):
                 continue
         return trainer, readme
 
-    def updateFile(self, id):
-        self.worker = Worker(self.asyncUpdateFile, id)
-        self.worker.finished.connect(self.onUpdateFileFinished)
-        self.worker.start()
+    def initScheduler(self):
+        """
+        定期在后台刷新列表和检查已下载应用的更新
+        """
+        # 后台检查发现有更新的应用id
+        self.updatesAvailable = set()
+        self.scheduler = Scheduler()
+        self.scheduler.add(
+            "catalog",
+            self.updateDB,
+            self.catalogRefreshMinutes * 60,
+            retry=SCHEDULER_RETRY,
+        )
+        self.scheduler.add(
+            "prefetch",
+            self.prefetchAppInfo,
+            self.prefetchMinutes * 60,
+            retry=SCHEDULER_RETRY,
+        )
+        self.scheduler.add(
+            "updates",
+            lambda: self.checkAllUpdates(background=True),
+            self.updateCheckMinutes * 60,
+            retry=SCHEDULER_RETRY,
+        )
+        self.schedulerTimer = QTimer(self)
+        self.schedulerTimer.setInterval(SCHEDULER_TICK_MS)
+        self.schedulerTimer.timeout.connect(self.scheduler.tick)
+        self.schedulerTimer.start()
+
+    def initDownloadQueue(self):
+        """
+        初始化下载队列并恢复上次未完成的任务
+        """
+        self.downloadQueue = DownloadQueue(
+            self.Session,
+            self.dbWriter,
+            {
+                "download": self.asyncDownloadFile,
+                "update": self.asyncUpdateFile,
+                "discard": self.discardPartial,
+            },
+            concurrency=self.downloadConcurrency,
+            perHost=self.downloadPerHost,
+            resolveHost=self.jobHost,
+            parent=self,
+        )
+        self.downloadQueue.jobChanged.connect(self.onJobChanged)
+        self.downloadQueue.jobProgress.connect(self.onJobProgress)
+        self.downloadQueue.jobFinished.connect(self.onJobFinished)
+        # 批量更新中未结束的任务 {任务id: 名称} 和已结束任务的结果 {状态: [名称]}
+        self.updateBatch = {}
+        self.updateBatchResults = {}
+        self.updatesChecked.connect(self.onUpdatesChecked)
+        if self.downloadPath:
+            # 清理上次退出时没删完的旧版本和移动下载目录后没删完的旧目录
+            Installer(self.downloadPath).purge()
+            for root in (self.downloadPath, os.path.join(self.downloadPath, "temp")):
+                threading.Thread(target=Relocator().cleanup, args=(root,), daemon=True).start()
+        self.relocateWorker = None
+        self.relocateItem = None
+        relocation = self.settings.get("relocation")
+        if relocation and relocation.get("from") == self.downloadPath:
+            # 上次移动下载目录没有完成, 继续
+            self.relocateDownloads(relocation["to"])
+        self.downloadQueue.restore()
+
+    def enqueueJob(self, id, kind, priority=DownloadQueue.PRIORITY_USER):
+        if self.relocateWorker is not None:
+            self.logMessage("正在移动下载目录, 请稍后再试")
+            return None
+        if not self.downloadPath:
+            self.openSettings()
+            return None
+        app = self.getAppById(id)
+        if not app:
+            return None
+        return self.downloadQueue.enqueue(id, kind, app.name_zh or app.name_en, priority)
+
+    def jobHost(self, id):
+        """
+        下载队列按压缩包下载地址的主机限制并发, 详情页结果会缓存, 随后的任务直接使用
+        """
+        app = self.getAppById(id)
+        if not app:
+            return ""
+        return urlsplit(self.getAppInfo(app.page_url).get("url") or "").netloc
+
+    def onJobChanged(self, jobId):
+        job = self.downloadQueue.jobs.get(jobId)
+        item = self.jobItems.get(jobId)
+        if job is None:
+            if item is not None:
+                self.jobList.takeTopLevelItem(self.jobList.indexOfTopLevelItem(item))
+                del self.jobItems[jobId]
+        else:
+            if item is None:
+                item = QTreeWidgetItem([job["name"], "", ""])
+                item.setData(0, Qt.UserRole, jobId)
+                self.jobList.addTopLevelItem(item)
+                self.jobItems[jobId] = item
+            labels = {"queued": "排队中", "running": "进行中", "paused": "已暂停"}
+            item.setText(1, f"{labels.get(job['status'], job['status'])}")
+            if job["kind"] == "update":
+                item.setText(0, f"{job['name']}(更新)")
+        self.jobList.setVisible(bool(self.jobItems))
+
+    def onJobProgress(self, jobId, received, total, speed):
+        item = self.jobItems.get(jobId)
+        if item is None:
+            return
+        if total:
+            item.setText(
+                2,
+                f"{received * 100 // total}% {received / 1048576:.1f}/{total / 1048576:.1f}MB "
+                f"{speed / 1048576:.2f}MB/s",
+            )
+        else:
+            item.setText(2, f"{received / 1048576:.1f}MB {speed / 1048576:.2f}MB/s")
+
+    def onJobFinished(self, jobId, status):
+        if status == "paused":
+            self.logMessage("下载已暂停")
+        elif status == "cancelled":
+            self.logMessage("下载已取消")
+        if jobId in self.updateBatch and status != "paused":
+            self.updateBatchResults.setdefault(status, []).append(
+                self.updateBatch.pop(jobId)
+            )
+            if not self.updateBatch:
+                labels = {"done": "完成", "failed": "失败", "cancelled": "取消"}
+                self.logMessage(
+                    "批量更新结束: "
+                    + " ".join(
+                        f"{labels.get(status, status)}{len(names)}个({'、'.join(names)})"
+                        for status, names in self.updateBatchResults.items()
+                    )
+                )
+                self.updateBatchResults = {}
+        self.searchData()
+
+    def showJobMenu(self, pos):
+        item = self.jobList.itemAt(pos)
+        if item is None:
+            return
+        jobId = item.data(0, Qt.UserRole)
+        job = self.downloadQueue.jobs.get(jobId)
+        if job is None:
+            return
+        menu = QMenu(self)
+        if job["status"] == "paused":
+            resumeAction = QAction("继续", menu)
+            resumeAction.triggered.connect(lambda: self.downloadQueue.resume(jobId))
+            menu.addAction(resumeAction)
+        else:
+            pauseAction = QAction("暂停", menu)
+            pauseAction.triggered.connect(lambda: self.downloadQueue.pause(jobId))
+            menu.addAction(pauseAction)
+        cancelAction = QAction("取消", menu)
+        cancelAction.triggered.connect(lambda: self.downloadQueue.cancel(jobId))
+        menu.addAction(cancelAction)
+        menu.exec_(self.jobList.viewport().mapToGlobal(pos))
+
+    def discardPartial(self, id):
+        """
+        删除暂停的任务保留的部分下载文件
+        """
+        app = self.getAppById(id)
+        if not app or not self.downloadPath:
+            return
+        app_info = self.appInfoCache.get(app.page_url)
+        if app_info:
+            shutil.rmtree(
+                os.path.join(self.downloadPath, "temp", app_info["md5"]),
+                ignore_errors=True,
+            )
+
+    def relocateDownloads(self, newDownloadPath):
+        """
+        在后台把已下载的应用移动到新的下载目录, 完成后再切换下载目录
+        """
+        if self.relocateWorker is not None:
+            self.logMessage("正在移动下载目录...")
+            return
+        if self.downloadQueue.workers:
+            self.logMessage("有正在进行的下载, 请稍后再修改下载目录")
+            return
+        # 移动期间恢复的和后台加入的任务都先不开始, 避免写入正在移动的目录
+        self.downloadQueue.hold(True)
+        # 记录未完成的移动, 中断后下次启动继续
+        self.settings["relocation"] = {"from": self.downloadPath, "to": newDownloadPath}
+        self.saveSettings()
+        self.logMessage("移动下载目录中...")
+        self.relocateItem = QTreeWidgetItem(["移动下载目录", "进行中", ""])
+        self.jobList.addTopLevelItem(self.relocateItem)
+        self.jobList.setVisible(True)
+        self.relocateWorker = Worker(
+            self.asyncRelocateDownloads,
+            self.downloadPath,
+            newDownloadPath,
+            withProgress=True,
+        )
+        self.relocateWorker.progress.connect(
+            lambda done, total, speed: self.relocateItem.setText(
+                2,
+                f"{done * 100 // max(total, 1)}% {done / 1048576:.1f}/{total / 1048576:.1f}MB "
+                f"{speed / 1048576:.2f}MB/s",
+            )
+        )
+        self.relocateWorker.finished.connect(
+            lambda: self.onRelocateFinished(newDownloadPath)
+        )
+        self.relocateWorker.start()
+
+    def asyncRelocateDownloads(self, oldDownloadPath, newDownloadPath, progress=None):
+        """
+        Returns:
+            dict: {"moved": 移动的应用数, "missing": 文件已丢失的应用数, "failed": 移动失败的应用数,
+                "pending": 已移动但旧目录没删干净的目录数}
+        """
+        session = self.Session()
+        try:
+            apps = (
+                session.query(FlingTrainerAppModel.id, FlingTrainerAppModel.save_path)
+                .filter(FlingTrainerAppModel.download == True)
+                .all()
+            )
+        finally:
+            session.close()
+        try:
+            moves = {}
+            for _, save_path in apps:
+                installDir = self.installDir(save_path)
+                if not installDir:
+                    continue
+                if os.path.commonpath(
+                    [os.path.abspath(installDir), os.path.abspath(oldDownloadPath)]
+                ) == os.path.abspath(oldDownloadPath):
+                    rel = os.path.relpath(installDir, oldDownloadPath)
+                else:
+                    rel = os.path.basename(installDir)
+                moves[installDir] = os.path.join(newDownloadPath, rel)
+            t1 = time.time()
+            relocator = Relocator(workers=max(1, self.prefetchWorkers), progress=progress)
+            # 先重试删除上次没删完的旧目录
+            pending = relocator.cleanup(newDownloadPath)
+            moved = relocator.relocate(list(moves.items()))
+            rows = []
+            missing = []
+            result = {
+                "moved": 0,
+                "missing": 0,
+                "failed": 0,
+                "pending": len(pending) + len(relocator.pending),
+            }
+            for id, save_path in apps:
+                installDir = self.installDir(save_path)
+                if installDir in moved:
+                    rel = os.path.relpath(save_path, installDir)
+                    rows.append(
+                        {
+                            "id": id,
+                            "save_path": os.path.normpath(
+                                os.path.join(moved[installDir], rel)
+                            ),
+                        }
+                    )
+                    result["moved"] += 1
+                elif not installDir or not os.path.exists(installDir):
+                    rows.append(
+                        {
+                            "id": id,
+                            "download": False,
+                            "app_md5": "",
+                            "save_path": "",
+                        }
+                    )
+                    missing.append(id)
+                    result["missing"] += 1
+                else:
+                    result["failed"] += 1
+            if not result["failed"]:
+                self.relocateTemp(relocator, oldDownloadPath, newDownloadPath, result)
+
+            def write(session):
+                # 一次批量更新所有路径
+                for keys in {tuple(row) for row in rows}:
+                    session.execute(
+                        update(FlingTrainerAppModel),
+                        [row for row in rows if tuple(row) == keys],
+                    )
+                save_readmes(session, dict.fromkeys(missing, ""))
+
+            self.dbWriter.run(write)
+            self.print(f"移动{result['moved']}个应用 耗时{time.time() - t1:.1f}秒")
+            return result
+        except Exception as err:
+            self.print(err)
+            self.logMessage("移动下载目录出错")
+            return None
 
-    def onUpdateFileFinished(self):
+    def relocateTemp(self, relocator, oldDownloadPath, newDownloadPath, result):
+        """
+        暂停和排队中任务的部分下载(temp/<md5>及其续传状态)随安装目录移动, 切换后接着续传;
+        都移走后删除旧的temp, 剩下的解压临时目录和回收目录不再需要
+        """
+        oldTemp = os.path.join(oldDownloadPath, "temp")
+        if not os.path.isdir(oldTemp):
+            return
+        partials = [
+            os.path.join(oldTemp, name)
+            for name in os.listdir(oldTemp)
+            if name != Installer.TRASH_DIR
+            and not name.endswith(Installer.STAGING_SUFFIX)
+            and os.path.isdir(os.path.join(oldTemp, name))
+        ]
+        newTemp = os.path.join(newDownloadPath, "temp")
+        moved = relocator.relocate(
+            [(src, os.path.join(newTemp, os.path.basename(src))) for src in partials]
+        )
+        # 部分下载没移完时不切换目录, 下次启动时继续
+        result["failed"] += len(partials) - len(moved)
+        if result["failed"]:
+            return
+        # 复制后没删掉的源目录也在旧的temp中, 一并删除
+        if Relocator.remove_source(oldTemp):
+            for dst in moved.values():
+                relocator.drop_manifest(dst)
+        else:
+            result["pending"] += 1
+
+    def onRelocateFinished(self, newDownloadPath):
+        result = self.relocateWorker.result
+        self.relocateWorker = None
+        self.jobList.takeTopLevelItem(self.jobList.indexOfTopLevelItem(self.relocateItem))
+        self.relocateItem = None
+        self.jobList.setVisible(bool(self.jobItems))
+        if not result or result["failed"]:
+            # 保留移动记录, 下次启动时继续
+            self.logMessage("移动下载目录未完成, 下次启动时继续")
+            self.downloadQueue.hold(False)
+            return
+        self.downloadPath = newDownloadPath
+        self.settings["download_path"] = self.downloadPath
+        self.settings.pop("relocation", None)
+        self.saveSettings()
+        # 切换到新目录后再开始等待中的任务
+        self.downloadQueue.hold(False)
+        self.logMessage(f"文件已移动: {result['moved']}个")
+        if result["pending"]:
+            self.logMessage(f"{result['pending']}个旧目录未能删除, 下次启动时重试")
         self.searchData()
 
-    def asyncUpdateFile(self, id):
+    def closeEvent(self, event):
+        self.downloadQueue.shutdown()
+        # 等待积压的写操作提交
+        self.dbWriter.close()
+        super().closeEvent(event)
+
+    def updateFile(self, id):
+        self.enqueueJob(id, "update")
+
+    def asyncUpdateFile(self, id, progress=None, cancel=None):
+        app = None
         try:
-            session = self.Session()
-            app = session.query(FlingTrainerAppModel).filter_by(id=id).first()
+            app = self.getAppById(id)
             if app:
                 # 更新文件逻辑
                 self.logMessage(
                     f"{app.name_zh if app.name_zh != '' else app.name_en}更新中..."
                 )
-                app_info = self.parse_app_info(app.page_url)
-                if app.app_md5 == app_info.get("md5"):
+                app_info = self.getAppInfo(app.page_url)
+                if not self.needsUpdate(app.app_md5, app.update_date, app_info):
                     self.logMessage(
                         f"{app.name_zh if app.name_zh != '' else app.name_en}已经是最新版本"
                     )
-                    return
-                trainer, readme = self.save_file(app_info, self.downloadPath)
-                if app.save_path != trainer:
-                    os.chmod(app.save_path, stat.S_IWRITE)
-                    shutil.rmtree(app.save_path, ignore_errors=True)
-                    print(os.stat(app.save_path))
-                app.save_path = trainer
-                app.update_date = app_info.get("date", "")
-                app.app_md5 = app_info.get("md5", "")
-                if readme != "":
-                    with open(readme, "rb") as f:
-                        raw_data = f.read()
-                        encoding = chardet.detect(raw_data)["encoding"]
-                    with open(readme, "r", encoding=encoding, errors="ignore") as fp:
-                        app.readme = fp.read()
-                else:
-                    app.readme = ""
-                app.download = True
-                session.commit()
-                self.logMessage("更新完成")
-            session.close()
+                    self.updatesAvailable.discard(id)
+                    return "done"
+                sha256, unpacked = self.fetch_archive(
+                    app_info, self.downloadPath, progress=progress, cancel=cancel
+                )
+                try:
+                    if (
+                        sha256 == app.content_sha256
+                        and app.save_path
+                        and os.path.exists(app.save_path)
+                    ):
+                        # 标题变了但内容相同, 只更新记录
+                        if unpacked:
+                            shutil.rmtree(unpacked, ignore_errors=True)
+                        self.updateApp(
+                            id,
+                            update_date=app_info.get("date", ""),
+                            app_md5=app_info.get("md5", ""),
+                        )
+                        self.logMessage(
+                            f"{app.name_zh if app.name_zh != '' else app.name_en}内容未变化, 已经是最新版本"
+                        )
+                        self.updatesAvailable.discard(id)
+                        return "done"
+                    old_dir = self.installDir(app.save_path)
+                    trainer, readme = self.install_archive(
+                        app_info, sha256, self.downloadPath, unpacked, live=old_dir
+                    )
+                    self.updateApp(
+                        id,
+                        readme=self.readmeDecoder.decode_file(readme) if readme != "" else "",
+                        save_path=trainer,
+                        update_date=app_info.get("date", ""),
+                        app_md5=app_info.get("md5", ""),
+                        content_sha256=app_info.get("sha256"),
+                        download=True,
+                    )
+                    # 数据库已指向新版本, 旧版本在后台删除
+                    if old_dir and os.path.exists(old_dir):
+                        Installer(os.path.dirname(old_dir)).retire(old_dir)
+                    self.updatesAvailable.discard(id)
+                    self.logMessage("更新完成")
+                finally:
+                    self.archiveStore.release(sha256)
+            return "done"
+        except DownloadCancelled as err:
+            return err.reason
         except Exception as err:
             self.print(err)
             self.logMessage("更新出错...")
+            if app:
+                # 详情页缓存可能已失效, 下次重新请求
+                self.appInfoCache.invalidate(app.page_url)
+            return "failed"
 
-    def downloadFile(self, id):
-        if not self.downloadPath:
-            self.openSettings()
-            return
-
-        self.worker = Worker(self.asyncDownloadFile, id)
-        self.worker.finished.connect(self.onDownloadFileFinished)
-        self.worker.start()
+    def archiveChanged(self, url):
+        """
+        标题没变时用ETag/Last-Modified/大小判断服务器上的文件是否被替换
+        """
+        source = self.archiveStore.source(url)
+        if source is None:
+            return False
+        remote = FileDownloader(self.http).remote_version(url)
+        if remote is None:
+            return False
+        return ArchiveStore.same_version(source, *remote) is False
 
-    def onDownloadFileFinished(self):
-        self.searchData()
+    def downloadFile(self, id):
+        self.enqueueJob(id, "download")
 
-    def asyncDownloadFile(self, id):
+    def asyncDownloadFile(self, id, progress=None, cancel=None):
+        app = None
         try:
-            session = self.Session()
-            app = session.query(FlingTrainerAppModel).filter_by(id=id).first()
+            app = self.getAppById(id)
             if app:
                 self.logMessage(
                     f"{app.name_zh if app.name_zh  else app.name_en}下载中..."
                 )
-                app_info = self.parse_app_info(app.page_url)
-                trainer, readme = self.save_file(app_info, self.downloadPath)
-                app.save_path = trainer
-                app.update_date = app_info.get("date", "")
-                app.app_md5 = app_info.get("md5", "")
-                if readme:
-                    with open(readme, "rb") as f:
-                        raw_data = f.read()
-                        encoding = chardet.detect(raw_data)["encoding"]
-                    with open(readme, "r", encoding=encoding, errors="ignore") as fp:
-                        app.readme = fp.read()
-                app.download = True
-                session.commit()
+                app_info = self.getAppInfo(app.page_url)
+                trainer, readme = self.save_file(
+                    app_info, self.downloadPath, progress=progress, cancel=cancel
+                )
+                self.updateApp(
+                    id,
+                    readme=self.readmeDecoder.decode_file(readme) if readme else None,
+                    save_path=trainer,
+                    update_date=app_info.get("date", ""),
+                    app_md5=app_info.get("md5", ""),
+                    content_sha256=app_info.get("sha256"),
+                    download=True,
+                )
             self.logMessage(f"{app.name_zh if app.name_zh  else app.name_en}下载完成")
-            session.close()
+            return "done"
+        except DownloadCancelled as err:
+            return err.reason
         except Exception as err:
             self.print(err)
             self.logMessage("下载出错")
+            if app:
+                # 详情页缓存可能已失效, 下次重新请求
+                self.appInfoCache.invalidate(app.page_url)
+            return "failed"
 
     def openSettings(self):
         dialog = SettingsDialog(self)
@@ -732,35 +2074,7 @@ class FlingTrainerApp(QWidget):
             self.settings["debug_mode"] = debugSwitch
             FlingCatTools.addWinDefnderWhite(newDownloadPath)
             if newDownloadPath and newDownloadPath != self.downloadPath:
-
-                session = self.Session()
-                apps = (
-                    session.query(FlingTrainerAppModel)
-                    .filter(FlingTrainerAppModel.download == True)
-                    .all()
-                )
-                for app in apps:
-                    if os.path.exists(app.save_path):
-                        res = shutil.move(
-                            os.path.dirname(app.save_path),
-                            newDownloadPath,
-                        )
-                        print("res", res)
-                        app.save_path = os.path.join(
-                            res, os.path.basename(app.save_path)
-                        )
-                        print("save_path", app.save_path)
-                        session.commit()
-                    else:
-                        app.download = False
-                        app.app_md5 = ""
-                        app.readme = ""
-                        app.save_path = ""
-                    session.commit()
-                session.close()
-                self.logMessage("文件已移动")
-                self.downloadPath = newDownloadPath
-                self.settings["download_path"] = self.downloadPath
+                self.relocateDownloads(newDownloadPath)
             self.saveSettings()
 
 
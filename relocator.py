@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class Relocator:
+    """
+    移动一组安装目录: 同一设备上直接重命名; 跨设备时多线程复制并校验哈希,
+    已复制的文件记录在目标临时目录的状态文件中, 中断后再次运行时跳过;
+    复制完成后在目标目录旁保存文件清单, 源目录删除干净后才删除清单, 没删完的下次重试
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    STATE_FILE = ".relocate.json"
+    TEMP_SUFFIX = ".relocating"
+    MANIFEST_SUFFIX = ".relocated.json"
+    PROGRESS_INTERVAL = 0.2
+
+    def __init__(self, workers=4, chunk_size=CHUNK_SIZE, progress=None):
+        """
+        Args:
+            workers (int): 跨设备复制的线程数
+            chunk_size (int): 每次读取写入的字节数
+            progress (callable): progress(已完成字节, 总字节, 速度字节/秒)
+        """
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self._lock = threading.Lock()
+        self._done = 0
+        self._total = 0
+        # 已复制完成但源目录没有删干净的源目录
+        self.pending = []
+
+    @staticmethod
+    def same_device(src, dst):
+        parent = os.path.dirname(dst)
+        os.makedirs(parent, exist_ok=True)
+        return os.stat(src).st_dev == os.stat(parent).st_dev
+
+    def relocate(self, moves):
+        """
+        Args:
+            moves (list): [(源目录, 目标目录)]
+
+        Returns:
+            dict: {源目录: 目标目录}, 源目录不存在或移动失败的不在其中
+        """
+        t1 = time.perf_counter()
+        self.pending = []
+        moved = {}
+        copies = []
+        for src, dst in moves:
+            if os.path.normcase(os.path.abspath(src)) == os.path.normcase(os.path.abspath(dst)):
+                # 已经在目标位置
+                moved[src] = dst
+                continue
+            if os.path.exists(dst):
+                manifest = self.load_manifest(dst)
+                if manifest is not None and self.verify(dst, manifest):
+                    # 上次复制完成但还没删完源目录
+                    moved[src] = dst
+                    self.finish(src, dst)
+                    continue
+                if not os.path.exists(src):
+                    # 上次已经重命名完成
+                    moved[src] = dst
+                    self.drop_manifest(dst)
+                    continue
+                # 目标位置是不完整或无关的内容, 移到一边后重新复制, 不删除任何数据
+                aside = f"{dst}.old-{time.time_ns()}"
+                print(f"{dst}已存在且与{src}不一致, 移动到{aside}")
+                os.rename(dst, aside)
+                self.drop_manifest(dst)
+            if not os.path.exists(src):
+                continue
+            if self.same_device(src, dst):
+                try:
+                    os.rename(src, dst)
+                    moved[src] = dst
+                    continue
+                except OSError as err:
+                    print(f"重命名{src}失败, 改为复制: {err}")
+            copies.append((src, dst))
+        if not copies:
+            return moved
+        plans = [self.plan(src, dst) for src, dst in copies]
+        self._total = sum(size for plan in plans for _, size in plan["files"])
+        self._done = sum(plan["skipped"] for plan in plans)
+        last = [t1]
+
+        def report():
+            now = time.perf_counter()
+            if self.progress and now - last[0] >= self.PROGRESS_INTERVAL:
+                last[0] = now
+                self.progress(self._done, self._total, self._done / max(now - t1, 1e-6))
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            futures = {}
+            for plan in plans:
+                for rel, size in plan["pending"]:
+                    future = pool.submit(self.copy_file, plan, rel, report)
+                    futures[future] = plan
+            for future in as_completed(futures):
+                plan = futures[future]
+                try:
+                    future.result()
+                except OSError as err:
+                    print(f"复制{plan['src']}失败: {err}")
+                    plan["failed"] = True
+        for plan in plans:
+            if plan.get("failed"):
+                continue
+            self.save_manifest(plan["src"], plan["dst"], plan["state"])
+            os.remove(os.path.join(plan["temp"], self.STATE_FILE))
+            os.rename(plan["temp"], plan["dst"])
+            moved[plan["src"]] = plan["dst"]
+            self.finish(plan["src"], plan["dst"])
+        if self.progress:
+            elapsed = time.perf_counter() - t1
+            self.progress(self._done, self._total, self._done / max(elapsed, 1e-6))
+        return moved
+
+    def plan(self, src, dst):
+        """
+        列出需要复制的文件, 跳过状态文件中已复制且大小一致的
+        """
+        temp = dst + self.TEMP_SUFFIX
+        os.makedirs(temp, exist_ok=True)
+        state_path = os.path.join(temp, self.STATE_FILE)
+        state = {}
+        if os.path.exists(state_path):
+            try:
+                with open(state_path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+        for root, dirs, _ in os.walk(src):
+            for name in dirs:
+                os.makedirs(
+                    os.path.join(temp, os.path.relpath(os.path.join(root, name), src)),
+                    exist_ok=True,
+                )
+        files = self.list_files(src)
+        pending = []
+        skipped = 0
+        for rel, size in files:
+            done = state.get(rel)
+            if done and done[0] == size and os.path.exists(os.path.join(temp, rel)):
+                skipped += size
+            else:
+                pending.append((rel, size))
+        return {
+            "src": src,
+            "dst": dst,
+            "temp": temp,
+            "state": state,
+            "files": files,
+            "pending": pending,
+            "skipped": skipped,
+        }
+
+    @staticmethod
+    def list_files(root):
+        """
+        Returns:
+            list: [(相对路径, 字节数)]
+        """
+        files = []
+        for parent, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(parent, name)
+                files.append((os.path.relpath(path, root), os.path.getsize(path)))
+        return files
+
+    def save_manifest(self, src, dst, state):
+        with open(dst + self.MANIFEST_SUFFIX, "w", encoding="utf-8") as f:
+            json.dump({"src": src, "files": state}, f)
+
+    def load_manifest(self, dst):
+        try:
+            with open(dst + self.MANIFEST_SUFFIX, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def drop_manifest(self, dst):
+        if os.path.exists(dst + self.MANIFEST_SUFFIX):
+            os.remove(dst + self.MANIFEST_SUFFIX)
+
+    def verify(self, dst, manifest):
+        """
+        清单中的文件在dst中都存在且大小一致时返回True, 修改器运行后新增的文件不影响
+        """
+        files = dict(self.list_files(dst))
+        return all(files.get(rel) == size for rel, (size, _) in manifest["files"].items())
+
+    def finish(self, src, dst):
+        """
+        删除已复制完成的源目录, 删干净后删除清单, 否则记为未完成以便下次重试
+        """
+        if os.path.exists(src) and not self.remove_source(src):
+            self.pending.append(src)
+            return
+        self.drop_manifest(dst)
+
+    def cleanup(self, root):
+        """
+        重试删除root下清单记录的、上次没删完的源目录
+
+        Returns:
+            list: 仍未删干净的源目录
+        """
+        self.pending = []
+        if not os.path.isdir(root):
+            return self.pending
+        for name in os.listdir(root):
+            if not name.endswith(self.MANIFEST_SUFFIX):
+                continue
+            dst = os.path.join(root, name[: -len(self.MANIFEST_SUFFIX)])
+            manifest = self.load_manifest(dst)
+            if manifest is None or not os.path.exists(dst) or not self.verify(dst, manifest):
+                # 目标目录已变化, 源目录可能是唯一完整的副本, 不删除
+                print(f"{dst}与移动记录不一致, 保留源目录")
+                self.drop_manifest(dst)
+                continue
+            self.finish(manifest["src"], dst)
+        return self.pending
+
+    @staticmethod
+    def remove_source(src):
+        errors = []
+
+        def onerror(func, path, _):
+            try:
+                # Windows下只读文件需要先去掉只读属性
+                os.chmod(path, stat.S_IWRITE)
+                func(path)
+            except OSError as err:
+                errors.append(f"{path}: {err}")
+
+        shutil.rmtree(src, onerror=onerror)
+        if errors or os.path.exists(src):
+            print(f"删除源目录{src}失败: {errors[:3]}")
+            return False
+        return True
+
+    def copy_file(self, plan, rel, report):
+        """
+        复制一个文件, 边复制边计算哈希, 写完后重新读取目标文件核对
+        """
+        src = os.path.join(plan["src"], rel)
+        dst = os.path.join(plan["temp"], rel)
+        digest = hashlib.sha256()
+        size = 0
+        with open(src, "rb") as fin, open(dst, "wb") as fout:
+            while True:
+                chunk = fin.read(self.chunk_size)
+                if not chunk:
+                    break
+                fout.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+                with self._lock:
+                    self._done += len(chunk)
+                    report()
+        shutil.copystat(src, dst)
+        if self.hash_file(dst) != digest.hexdigest():
+            raise OSError(f"{rel}复制后校验失败")
+        with self._lock:
+            plan["state"][rel] = [size, digest.hexdigest()]
+            self.save_state(plan)
+
+    def hash_file(self, path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as fp:
+            while True:
+                chunk = fp.read(self.chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def save_state(self, plan):
+        state_path = os.path.join(plan["temp"], self.STATE_FILE)
+        with open(state_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(plan["state"], f)
+        os.replace(state_path + ".tmp", state_path)
@@ -0,0 +1,88 @@
+import random
+import time
+
+
+class Scheduler:
+    """
+    周期任务调度器, 成功后按间隔加随机抖动安排下次运行, 失败后按指数退避重试;
+    上次运行未结束时跳过本次. 不自己计时, 由调用方定期调用tick(), 时钟和随机数可替换以便测试
+    """
+
+    def __init__(self, clock=time.monotonic, rand=random.random):
+        """
+        Args:
+            clock (callable): 返回当前时间(秒)
+            rand (callable): 返回[0, 1)的随机数
+        """
+        self.clock = clock
+        self.rand = rand
+        self.tasks = {}
+
+    def add(self, name, start, interval, retry=60, jitter=0.1, delay=None):
+        """
+        Args:
+            name (str): 任务名
+            start (callable): 开始运行任务, 返回False表示已在运行(如被手动触发)而未开始;
+                任务结束后调用方需调用done()
+            interval (float): 成功后的运行间隔(秒), 不大于0时不运行
+            retry (float): 第一次失败后的重试间隔(秒), 之后每次失败加倍, 不超过interval
+            jitter (float): 间隔上下浮动的比例, 避免多个客户端同时请求
+            delay (float): 第一次运行前的等待时间, 默认为一个间隔
+        """
+        self.tasks[name] = {
+            "start": start,
+            "interval": interval,
+            "retry": retry,
+            "jitter": jitter,
+            "next_run": self.clock() + (interval if delay is None else delay),
+            "running": False,
+            "failures": 0,
+            "skipped": 0,
+        }
+
+    def jittered(self, task, seconds):
+        return seconds * (1 + task["jitter"] * (2 * self.rand() - 1))
+
+    def backoff(self, task):
+        """
+        连续失败n次后的等待时间
+        """
+        delay = task["retry"] * 2 ** (task["failures"] - 1)
+        return min(delay, max(task["interval"], task["retry"]))
+
+    def tick(self):
+        """
+        运行所有到期的任务
+
+        Returns:
+            list: 本次开始运行的任务名
+        """
+        now = self.clock()
+        started = []
+        for name, task in self.tasks.items():
+            if task["interval"] <= 0 or now < task["next_run"]:
+                continue
+            if task["running"] or task["start"]() is False:
+                # 上次还没结束, 等下一个间隔
+                task["skipped"] += 1
+                task["next_run"] = now + self.jittered(task, task["interval"])
+                continue
+            task["running"] = True
+            started.append(name)
+        return started
+
+    def done(self, name, ok=True):
+        """
+        任务结束, 没有通过调度器开始的运行(如手动触发)不影响调度
+        """
+        task = self.tasks.get(name)
+        if task is None or not task["running"]:
+            return
+        task["running"] = False
+        if ok:
+            task["failures"] = 0
+            delay = task["interval"]
+        else:
+            task["failures"] += 1
+            delay = self.backoff(task)
+        task["next_run"] = self.clock() + self.jittered(task, delay)